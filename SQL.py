@@ -1,13 +1,29 @@
 import os
 import re
+import json
 import time
+import ctypes
+import ctypes.util
+import select
+import struct
 import logging
 import schedule
 import threading
-import mysql.connector
 from datetime import datetime, timedelta
 from mysql.connector import Error
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import db
+import metrics
+import raw_store
+from atomic_file import write_atomic
+from events import ALERTS_INGESTED, publish
+from migrations import RETENTION_DAYS, apply_migrations, rotate_partitions
+
+# orjson decodes Zircolite lines several times faster when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -16,87 +32,41 @@ logger = logging.getLogger()
 # Folder path for logs
 log_folder = os.getenv("LOG_FOLDER_PATH", "/var/log/logstash/detected_zircolite/")
 
-# Database configuration (Using environment variables for security)
-db_config = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "user": os.getenv("DB_USER", "sigma"),
-    "password": os.getenv("DB_PASSWORD", "sigma"),
-    "database": os.getenv("DB_NAME", "sigma_db"),
-}
-
-# Bookmark file to track the last processed log time
+# Bookmark file of the last processed log time, only read once to migrate to checkpoints
 bookmark_file = "bookmark.txt"
 
+# Per-file read checkpoints (device, inode, byte offset, size, mtime)
+checkpoint_file = os.getenv("CHECKPOINT_FILE", "checkpoints.json")
+checkpoint_lock = threading.Lock()
+
+# Folder polling when inotify is unavailable, and full rescans as a safety net when it is
+POLL_INTERVAL = 5
+RESCAN_INTERVAL = 60
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
 # Batch size for database insertions
 BATCH_SIZE = 1000
 
-# Initialize SQL tables
-def initialize_sql_tables():
-    """Create the sigma_alerts and dbscan_outlier tables in the database if they don't exist."""
-    try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
-            # Create sigma_alerts table
-            create_sigma_alerts_query = """
-            CREATE TABLE IF NOT EXISTS sigma_alerts (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                title VARCHAR(255),
-                tags TEXT,
-                description TEXT,
-                system_time DATETIME,
-                computer_name VARCHAR(100),
-                user_id VARCHAR(100),
-                event_id VARCHAR(50),
-                provider_name VARCHAR(100),
-                dbscan_cluster INT,
-                raw TEXT
-            );
-            """
-            cursor.execute(create_sigma_alerts_query)
-
-            # Create dbscan_outlier table
-            create_dbscan_outlier_query = """
-            CREATE TABLE IF NOT EXISTS dbscan_outlier (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                title VARCHAR(255),
-                tags TEXT,
-                description TEXT,
-                system_time DATETIME,
-                computer_name VARCHAR(100),
-                user_id VARCHAR(100),
-                event_id VARCHAR(50),
-                provider_name VARCHAR(100),
-                dbscan_cluster INT,
-                raw TEXT
-            );
-            """
-            cursor.execute(create_dbscan_outlier_query)
-
-            connection.commit()
-            logger.info("Initialized SQL tables 'sigma_alerts' and 'dbscan_outlier'.")
-    except Error as e:
-        logger.error(f"Error initializing SQL tables: {e}")
-    finally:
-        if connection.is_connected():
-            connection.close()
-
-# Ensure columns exist
-def ensure_column_exists(table_name, column_name, column_definition):
-    """Ensure the specified column exists in the given table."""
-    try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
-            cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE '{column_name}'")
-            result = cursor.fetchone()
-            if not result:
-                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
-                connection.commit()
-                logger.info(f"Added '{column_name}' column to '{table_name}' table.")
-    except Error as e:
-        logger.error(f"Error ensuring '{column_name}' column exists in '{table_name}': {e}")
-    finally:
-        if connection.is_connected():
-            connection.close()
+# Callables receiving (ids, rows) of every committed sigma_alerts chunk; pipeline.py hands them to clustering in memory
+ingest_listeners = []
+
+# Zircolite fields extracted from each log line
+LOG_FIELDS = ("title", "tags", "description", "SystemTime", "Computer", "UserID", "EventID", "Provider_Name")
+
+# Single-pass fallback for lines that are not valid JSON
+LOG_FIELD_PATTERN = re.compile(
+    r'"(title|description|SystemTime|Computer|UserID|Provider_Name)":"((?:[^"\\]|\\.)*)"'
+    r'|"(tags)":\[(.*?)\]'
+    r'|"(EventID)":(\d+)'
+)
 
 # Read the last processed timestamp from the bookmark file
 def read_last_processed_time():
@@ -115,129 +85,211 @@ def read_last_processed_time():
         logger.info("Bookmark file does not exist.")
     return None  # Return None if the file does not exist, is empty, or contains invalid data
 
-# Update the bookmark file with the latest processed timestamp
-def update_last_processed_time(last_processed_time):
-    """Update the bookmark file with the latest processed timestamp."""
-    if isinstance(last_processed_time, datetime):
-        with open(bookmark_file, "w") as file:
-            file.write(last_processed_time.strftime("%Y-%m-%d %H:%M:%S"))
-        logger.info(f"Updated bookmark file with timestamp: {last_processed_time}")
-    else:
-        logger.error(f"Expected datetime object for last_processed_time, got {type(last_processed_time)}")
+# Read the per-file checkpoints
+def read_checkpoints():
+    """Read the per-file read checkpoints, keyed by file name."""
+    if not os.path.exists(checkpoint_file):
+        return {}
+    try:
+        with open(checkpoint_file, "r") as file:
+            return json.load(file)
+    except (ValueError, OSError) as e:
+        logger.error(f"Invalid checkpoint file {checkpoint_file}: {e}")
+        return {}
+
+# Atomically persist the per-file checkpoints
+def write_checkpoints(checkpoints):
+    """Replace the checkpoint file with the current checkpoints."""
+    write_atomic(checkpoint_file, json.dumps(checkpoints))
+
+# Collect the first occurrence of each field, in document order
+def find_log_fields(node, fields):
+    """Walk a decoded log record and collect the first value of each field in LOG_FIELDS."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in LOG_FIELDS and key not in fields:
+                fields[key] = value
+            if isinstance(value, (dict, list)):
+                find_log_fields(value, fields)
+    elif isinstance(node, list):
+        for item in node:
+            find_log_fields(item, fields)
+    return fields
+
+# Extract the fields of a single log line
+def parse_log_line(line):
+    """Decode a log line once and return its fields, using a single regex scan when it is not JSON."""
+    try:
+        record = json_loads(line)
+        fields = find_log_fields(record, {})
+        tags = fields.get("tags")
+        if isinstance(tags, list):
+            fields["tags"] = ",".join(str(tag) for tag in tags)
+        return {key: str(value).strip() for key, value in fields.items() if value is not None}
+    except ValueError:
+        fields = {}
+        for match in LOG_FIELD_PATTERN.finditer(line.decode("utf-8", errors="replace")):
+            key = match.group(1) or match.group(3) or match.group(5)
+            if key not in fields:
+                value = match.group(2) if match.group(1) else match.group(4) if match.group(3) else match.group(6)
+                fields[key] = value.replace('"', "").strip() if key == "tags" else value.strip()
+        return fields
 
 # Extract and process data from the log file
-def process_log_file(file_path, last_processed_time):
-    """Process a single log file and extract required fields."""
+def process_log_file(file_path, last_processed_time, start_offset=0, batch_size=BATCH_SIZE):
+    """Stream a log file from start_offset and yield (rows, latest_time, end_offset) batches.
+
+    Lines are read lazily and decoded once each, so memory stays flat
+    regardless of the file size. Only complete lines are consumed; a line
+    still being written is left for the next read. end_offset is the byte
+    offset just past the last consumed line.
+    """
     processed_data = []
     latest_time = last_processed_time
+    offset = reported_offset = start_offset
+    lines = failures = 0
     try:
-        with open(file_path, "r") as file:
-            lines = file.readlines()
-
-        logger.info(f"Reading file: {file_path}")
+        logger.info(f"Reading file: {file_path} from offset {start_offset}")
+        with open(file_path, "rb") as file:
+            file.seek(start_offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # The writer has not finished this line yet
+                offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
 
-        for line in lines:
-            if not line.strip():
-                continue
-
-            try:
-                # Extract fields using regex
-                title = re.search(r'"title":"(.*?)"', line)
-                tags = re.search(r'"tags":\[(.*?)\]', line)
-                description = re.search(r'"description":"((?:[^"\\]|\\.)*)"', line)
-                system_time = re.search(r'"SystemTime":"(.*?)"', line)
-                computer_name = re.search(r'"Computer":"(.*?)"', line)
-                user_id = re.search(r'"UserID":"(.*?)"', line)
-                event_id = re.search(r'"EventID":(\d+)', line)
-                provider_name = re.search(r'"Provider_Name":"(.*?)"', line)
-
-                # Extract and clean data
-                title = title.group(1).strip() if title else None
-                tags = tags.group(1).replace('"', "").strip() if tags else None
-                description = description.group(1).strip() if description else None
-                computer_name = computer_name.group(1).strip() if computer_name else None
-                user_id = user_id.group(1).strip() if user_id else None
-                event_id = event_id.group(1).strip() if event_id else None
-                provider_name = provider_name.group(1).strip() if provider_name else None
-
-                # Convert SystemTime to MySQL-compatible format
-                if system_time:
-                    try:
-                        truncated_time = system_time.group(1).replace(" ", "").split('.')[0] + "Z"
-                        system_time = datetime.strptime(truncated_time, "%Y-%m-%dT%H:%M:%SZ")
-                        if last_processed_time and system_time <= last_processed_time:
-                            continue  # Skip already processed entries
-                        if not latest_time or system_time > latest_time:
-                            latest_time = system_time
-                    except ValueError as e:
-                        logger.error(f"Failed to process time: {system_time} | Error: {e}")
-                        system_time = None
-
-                processed_data.append((title, tags, description, system_time.strftime("%Y-%m-%d %H:%M:%S"), computer_name, user_id, event_id, provider_name, line.strip()))
+                try:
+                    fields = parse_log_line(line)
+                    system_time = fields.get("SystemTime")
+
+                    # Convert SystemTime to MySQL-compatible format
+                    if system_time:
+                        try:
+                            truncated_time = system_time.replace(" ", "").split('.')[0].rstrip("Z") + "Z"
+                            system_time = datetime.strptime(truncated_time, "%Y-%m-%dT%H:%M:%SZ")
+                            if last_processed_time and system_time <= last_processed_time:
+                                continue  # Skip already processed entries
+                            if not latest_time or system_time > latest_time:
+                                latest_time = system_time
+                        except ValueError as e:
+                            logger.error(f"Failed to process time: {system_time} | Error: {e}")
+                            system_time = None
+
+                    processed_data.append((
+                        fields.get("title"),
+                        fields.get("tags"),
+                        fields.get("description"),
+                        # system_time is the partitioning key, alerts without one age out from ingest time
+                        (system_time or datetime.now()).strftime("%Y-%m-%d %H:%M:%S"),
+                        fields.get("Computer"),
+                        fields.get("UserID"),
+                        fields.get("EventID"),
+                        fields.get("Provider_Name"),
+                        line.decode("utf-8", errors="replace"),
+                    ))
+                    if len(processed_data) >= batch_size:
+                        count_parsed(lines, failures)
+                        lines = failures = 0
+                        yield processed_data, latest_time, offset
+                        processed_data = []
+                        reported_offset = offset
 
-            except Exception as e:
-                logger.error(f"Failed to process line: {line.strip()} | Error: {e}")
+                except Exception as e:
+                    failures += 1
+                    logger.error(f"Failed to process line: {line[:200]} | Error: {e}")
     except Exception as e:
         logger.error(f"Error reading log file {file_path}: {e}")
 
-    return processed_data, latest_time
+    count_parsed(lines, failures)
+    if processed_data or offset != reported_offset:
+        yield processed_data, latest_time, offset
 
-# Get the maximum existing cluster value
-def get_max_cluster_value():
-    """Get the maximum existing cluster value from the sigma_alerts table."""
-    try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT MAX(dbscan_cluster) FROM sigma_alerts")
-            result = cursor.fetchone()
-            return result[0] if result[0] is not None else 0
-    except Error as e:
-        logger.error(f"Error fetching max cluster value: {e}")
-        return 0
-    finally:
-        if connection.is_connected():
-            connection.close()
+def count_parsed(lines, failures):
+    """Add the lines read since the last batch to the parse counters."""
+    metrics.inc("lines_parsed_total", lines)
+    if failures:
+        metrics.inc("parse_failures_total", failures)
 
 # Batch insert data into the SQL database (sigma_alerts or dbscan_outlier)
-def insert_data_to_sql(data, table, cluster_value):
-    """Insert processed data into the specified table ('sigma_alerts' or 'dbscan_outlier')."""
+def insert_data_to_sql(data, table, source):
+    """Insert processed data into the specified table ('sigma_alerts' or 'dbscan_outlier'). Returns False on error.
+
+    Every chunk gets its own ingest batch id from the AUTO_INCREMENT key of
+    ingest_batches, allocated in the same transaction as the chunk's rows, so
+    parallel ingest threads never share or wait on an id. Raw lines go to
+    alert_raw, once per distinct line, and rows carry their hash. Rows are inserted
+    with dbscan_cluster NULL until dbscan.py clusters them; each committed
+    sigma_alerts chunk is announced on the alerts_ingested channel and
+    passed to the ingest_listeners. Listeners may block, so they are called
+    once the connection is back in the pool.
+    """
     if data:
+        start_time = time.perf_counter()
+        committed = []
         try:
-            connection = mysql.connector.connect(**db_config)
-            with connection.cursor() as cursor:
+            with metrics.stage("insert", table=table), db.connection() as connection, connection.cursor() as cursor:
+                # executemany rewrites this into multi-row INSERT statements
                 insert_query = f"""
-                INSERT INTO {table} (title, tags, description, system_time, computer_name, user_id, event_id, provider_name, dbscan_cluster, raw)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                INSERT INTO {table} (title, tags, description, system_time, computer_name, user_id, event_id, provider_name, ingest_batch_id, raw_hash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """
+
                 # Batch insert in chunks
                 for i in range(0, len(data), BATCH_SIZE):
                     batch = data[i:i + BATCH_SIZE]
-                    data_with_cluster = [(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], cluster_value, row[8]) for row in batch]
-                    cursor.executemany(insert_query, data_with_cluster)
+                    cursor.execute("INSERT INTO ingest_batches (source, row_count) VALUES (%s, %s)", (source, len(batch)))
+                    batch_id = cursor.lastrowid
+                    raw_hashes = raw_store.store_raw(cursor, [(row[8], row[3]) for row in batch])
+                    data_with_batch = [
+                        (row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], batch_id, raw_hash)
+                        for row, raw_hash in zip(batch, raw_hashes)
+                    ]
+                    cursor.executemany(insert_query, data_with_batch)
                     connection.commit()
-                logger.info(f"Inserted {len(data)} rows into '{table}' with cluster value {cluster_value}.")
+                    metrics.inc("rows_inserted_total", len(batch), table=table)
+                    logger.info(f"Inserted {len(batch)} rows into '{table}' as ingest batch {batch_id}.")
+
+                    if table == 'sigma_alerts':
+                        # Ids of the chunk in insert order, read from the ingest_batch_id index
+                        cursor.execute("SELECT id FROM sigma_alerts WHERE ingest_batch_id = %s ORDER BY id", (batch_id,))
+                        ids = [row[0] for row in cursor.fetchall()]
+                        committed.append((ids, batch))
+                        # Tell dbscan.py that new rows are waiting, up to which id
+                        publish(ALERTS_INGESTED, rows=len(batch), max_id=ids[-1] if ids else None, batch_id=batch_id)
         except Error as e:
             logger.error(f"Error inserting data into {table}: {e}")
+            return False
         finally:
-            if connection.is_connected():
-                connection.close()
+            for ids, batch in committed:
+                for listener in ingest_listeners:
+                    listener(ids, batch)
+        metrics.set_gauge("insert_rows_per_second", len(data) / max(time.perf_counter() - start_time, 1e-9), table=table)
+    return True
 
-# Truncate data older than 7 days
+# Truncate data older than the retention period
 def truncate_old_data():
-    """Delete data older than 7 days from the sigma_alerts table."""
+    """Drop data older than RETENTION_DAYS (7 by default) from the sigma_alerts table.
+
+    On the day-partitioned table expired days are dropped as whole partitions,
+    which is instant and takes no row locks; an unpartitioned table falls back
+    to a DELETE.
+    """
     try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
-            seven_days_ago = datetime.now() - timedelta(days=7)
-            delete_query = "DELETE FROM sigma_alerts WHERE system_time < %s"
-            cursor.execute(delete_query, (seven_days_ago.strftime("%Y-%m-%d %H:%M:%S"),))
-            connection.commit()
-            logger.info("Truncated data older than 7 days from 'sigma_alerts' table.")
+        with db.connection() as connection, connection.cursor() as cursor:
+            cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+            if not rotate_partitions(cursor, cutoff.date()):
+                delete_query = "DELETE FROM sigma_alerts WHERE system_time < %s"
+                cursor.execute(delete_query, (cutoff.strftime("%Y-%m-%d %H:%M:%S"),))
+                connection.commit()
+            logger.info(f"Truncated data older than {RETENTION_DAYS} days from 'sigma_alerts' table.")
+            # Partitions go by whole days, so payloads are kept until their last alert's day is dropped
+            pruned = raw_store.prune_raw(connection, cursor, cutoff.strftime("%Y-%m-%d"))
+            logger.info(f"Pruned {pruned} raw payloads last seen before {cutoff:%Y-%m-%d} from 'alert_raw' table.")
     except Error as e:
         logger.error(f"Error truncating old data: {e}")
-    finally:
-        if connection.is_connected():
-            connection.close()
 
 # Schedule truncation every 12 hours
 def schedule_truncation():
@@ -247,64 +299,182 @@ def schedule_truncation():
         schedule.run_pending()
         time.sleep(1)
 
-# Process a single log file and insert data into the database
-def process_and_insert_log(file_name, last_processed_time):
+# Whether a checkpoint was taken of the file with this stat
+def same_file(checkpoint, stat):
+    """Compare device and inode; checkpoints written before the device was stored only compare the inode."""
+    return checkpoint["inode"] == stat.st_ino and checkpoint.get("device", stat.st_dev) == stat.st_dev
+
+# Carry checkpoints over renames
+def follow_renames(folder, file_names, checkpoints):
+    """Move the checkpoint of a renamed log file to its new name.
+
+    Rotation renames app.log to app.log.1 and creates a new app.log; the
+    checkpoint follows the file's device and inode, so the renamed file
+    resumes at its offset instead of being ingested again from the start.
+    """
+    with checkpoint_lock:
+        moved = {}
+        for file_name in file_names:
+            try:
+                stat = os.stat(os.path.join(folder, file_name))
+            except OSError:
+                continue
+            checkpoint = checkpoints.get(file_name)
+            if checkpoint and same_file(checkpoint, stat):
+                continue
+            for old_name, old_checkpoint in checkpoints.items():
+                if old_name != file_name and same_file(old_checkpoint, stat):
+                    moved[file_name] = old_name
+                    break
+        if not moved:
+            return
+        renamed = {file_name: checkpoints[old_name] for file_name, old_name in moved.items()}
+        for old_name in set(moved.values()) - set(moved):
+            del checkpoints[old_name]
+        checkpoints.update(renamed)
+        for file_name, old_name in moved.items():
+            logger.info(f"File {old_name} was renamed to {file_name}, resuming it at offset {renamed[file_name]['offset']}.")
+        write_checkpoints(checkpoints)
+
+# Process the appended part of a log file and insert data into the database
+def process_and_insert_log(file_name, checkpoints, last_processed_time=None):
+    """Ingest the lines appended to a log file since its checkpoint.
+
+    A changed device or inode means the file was replaced and a size below
+    the checkpoint offset means it was truncated; both are read again from
+    the start. The checkpoint is advanced after every inserted batch.
+    """
     full_path = os.path.join(log_folder, file_name)
-    logger.info(f"Processing file: {full_path}")
-    data, latest_time = process_log_file(full_path, last_processed_time)
-    if data:
-        cluster_value = get_max_cluster_value() + 1
-        insert_data_to_sql(data, 'sigma_alerts', cluster_value)
-    return latest_time
+    try:
+        stat = os.stat(full_path)
+    except FileNotFoundError:
+        return
+    if not os.path.isfile(full_path):
+        return
+
+    with checkpoint_lock:
+        checkpoint = checkpoints.get(file_name)
+
+    start_offset = 0
+    if checkpoint:
+        if not same_file(checkpoint, stat):
+            logger.info(f"File {full_path} was rotated, reading it from the start.")
+        elif stat.st_size < checkpoint["offset"]:
+            logger.info(f"File {full_path} was truncated, reading it from the start.")
+        elif stat.st_size == checkpoint["offset"]:
+            return  # Nothing appended since the last read
+        else:
+            start_offset = checkpoint["offset"]
 
-# Monitor and process new log files
+    logger.info(f"Processing file: {full_path}")
+    metrics.inc("files_parsed_total")
+    for batch, _, end_offset in process_log_file(full_path, last_processed_time, start_offset):
+        if batch:
+            if not insert_data_to_sql(batch, 'sigma_alerts', file_name):
+                metrics.inc("insert_failures_total")
+                return  # Keep the checkpoint so the batch is retried on the next read
+
+        with checkpoint_lock:
+            checkpoints[file_name] = {
+                "device": stat.st_dev,
+                "inode": stat.st_ino,
+                "offset": end_offset,
+                "size": max(stat.st_size, end_offset),
+                "mtime": stat.st_mtime,
+            }
+            write_checkpoints(checkpoints)
+
+# Process several log files in parallel
+def process_files(file_names, checkpoints, last_processed_time=None):
+    """Ingest the appended lines of the given files with a thread per file."""
+    if not file_names:
+        return
+    follow_renames(log_folder, file_names, checkpoints)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {executor.submit(process_and_insert_log, file_name, checkpoints, last_processed_time): file_name for file_name in file_names}
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error processing file {file_name}: {e}")
+
+# List the log files and forget checkpoints of deleted files
+def list_log_files(folder, checkpoints):
+    """Return the regular files in the folder and drop checkpoints of files that are gone, after following renames."""
+    file_names = {entry.name for entry in os.scandir(folder) if entry.is_file()}
+    follow_renames(folder, file_names, checkpoints)
+    with checkpoint_lock:
+        for file_name in set(checkpoints) - file_names:
+            del checkpoints[file_name]
+    return file_names
+
+# Watch the folder with inotify
+def open_inotify_watch(folder):
+    """Return a non-blocking inotify descriptor watching the folder, or None when inotify is unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(folder), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+# Wait for inotify events
+def read_inotify_events(fd, timeout):
+    """Wait up to timeout seconds for inotify events and return the names of the changed files."""
+    changed = set()
+    readable, _, _ = select.select([fd], [], [], timeout)
+    if not readable:
+        return changed
+    while True:
+        try:
+            buffer = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + INOTIFY_EVENT_HEADER.size <= len(buffer):
+            _, _, _, length = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                changed.add(os.fsdecode(name))
+
+# Monitor and process log files
 def monitor_folder(log_folder):
-    """Monitor the folder and process new log files as they arrive."""
-    processed_files = set()
-    last_processed_time = read_last_processed_time()
-
-    if last_processed_time is None:
-        # Process all files if no bookmark exists or is empty
-        logger.info("Processing all files as no bookmark exists.")
-        all_files = sorted(os.listdir(log_folder))
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            futures = {executor.submit(process_and_insert_log, file_name, last_processed_time): file_name for file_name in all_files}
-            for future in as_completed(futures):
-                file_name = futures[future]
-                try:
-                    result = future.result()
-                    if result and (last_processed_time is None or result > last_processed_time):
-                        last_processed_time = result
-                except Exception as e:
-                    logger.error(f"Error processing file {file_name}: {e}")
-
-        if last_processed_time:
-            update_last_processed_time(last_processed_time)
-
-    else:
-        logger.info(f"Initial last processed time: {last_processed_time}")
+    """Tail the log files in the folder and ingest appended lines as they arrive."""
+    legacy_time = None
+    if not os.path.exists(checkpoint_file):
+        # First start with checkpoints: skip what the old bookmark already covered
+        legacy_time = read_last_processed_time()
+        if legacy_time:
+            logger.info(f"Migrating from bookmark, skipping entries up to {legacy_time} on the first pass.")
+
+    checkpoints = read_checkpoints()
+    process_files(sorted(list_log_files(log_folder, checkpoints)), checkpoints, legacy_time)
+
+    watch_fd = open_inotify_watch(log_folder)
+    if watch_fd is None:
+        logger.info(f"inotify is unavailable, polling {log_folder} every {POLL_INTERVAL} seconds.")
+    last_scan = time.monotonic()
 
     while True:
         try:
-            current_files = set(os.listdir(log_folder))
-            new_files = current_files - processed_files
-
-            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-                futures = {executor.submit(process_and_insert_log, new_file, last_processed_time): new_file for new_file in new_files}
-                for future in as_completed(futures):
-                    file_name = futures[future]
-                    try:
-                        result = future.result()
-                        if result and (last_processed_time is None or result > last_processed_time):
-                            last_processed_time = result
-                        processed_files.add(file_name)
-                    except Exception as e:
-                        logger.error(f"Error processing file {file_name}: {e}")
-
-            if last_processed_time:
-                update_last_processed_time(last_processed_time)
-
-            time.sleep(5)  # Check for new files every 5 seconds
+            if watch_fd is not None:
+                changed = read_inotify_events(watch_fd, RESCAN_INTERVAL)
+                if time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                    changed |= list_log_files(log_folder, checkpoints)
+                    last_scan = time.monotonic()
+            else:
+                time.sleep(POLL_INTERVAL)
+                changed = list_log_files(log_folder, checkpoints)
+
+            process_files(sorted(changed), checkpoints)
 
         except KeyboardInterrupt:
             logger.info("Stopping monitoring.")
@@ -314,11 +484,9 @@ def monitor_folder(log_folder):
 
 # Main execution
 if __name__ == "__main__":
-    initialize_sql_tables()
-    ensure_column_exists("sigma_alerts", "dbscan_cluster", "INT")
-    ensure_column_exists("dbscan_outlier", "dbscan_cluster", "INT")
-    ensure_column_exists("sigma_alerts", "raw", "TEXT")
-    ensure_column_exists("dbscan_outlier", "raw", "TEXT")
+    apply_migrations()
+    metrics.start()
+    truncate_old_data()
 
     # Start the truncation scheduling in a separate thread
     truncation_thread = threading.Thread(target=schedule_truncation)
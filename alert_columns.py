@@ -0,0 +1,81 @@
+import numpy as np
+
+# String fields of a fetched alert row, after its id, in SELECT order
+ALERT_FIELDS = ("title", "tags", "computer_name", "user_id", "event_id", "provider_name")
+
+class AlertColumns:
+    """Fetched alerts held column-wise: an id array and one dictionary-encoded array per string field.
+
+    Each field keeps its distinct values once in `values[field]` and an int32
+    code per row in `codes[field]`, so per-value work (vectorising a title,
+    encoding a host) runs once per distinct value and is fanned out to the
+    rows by indexing with the codes.
+    """
+
+    def __init__(self, ids, codes, values):
+        self.ids = ids
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def max_id(self):
+        return int(self.ids.max())
+
+    def counts(self, field, weights=None):
+        """Number of rows, or total weight of the rows, holding each distinct value of the field."""
+        return np.bincount(self.codes[field], weights=weights, minlength=len(self.values[field]))
+
+    def take(self, indices):
+        return AlertColumns(self.ids[indices], {field: codes[indices] for field, codes in self.codes.items()}, self.values)
+
+    def unique_rows(self):
+        """Group rows that are identical in every field.
+
+        The codes of a row are its exact key, so no hashing or collision
+        handling is needed. Returns the first row of each group, the group
+        of every row and the row count of each group.
+        """
+        keys = np.stack([self.codes[field] for field in ALERT_FIELDS], axis=1)
+        _, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+        return self.take(first), inverse.ravel(), counts
+
+    @classmethod
+    def from_rows(cls, rows):
+        builder = AlertColumnsBuilder()
+        builder.extend(rows)
+        return builder.finish()
+
+class AlertColumnsBuilder:
+    """Dictionary-encode (id, *ALERT_FIELDS) rows chunk by chunk, so the rows themselves need not be kept."""
+
+    def __init__(self):
+        self.id_chunks = []
+        self.code_chunks = {field: [] for field in ALERT_FIELDS}
+        self.tables = {field: {} for field in ALERT_FIELDS}
+
+    def extend(self, rows):
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self.id_chunks.append(np.array(columns[0], dtype=np.int64))
+        for field, column in zip(ALERT_FIELDS, columns[1:]):
+            table = self.tables[field]
+            encode = table.setdefault
+            # setdefault gives an unseen value the next code
+            self.code_chunks[field].append(np.array([encode(value, len(table)) for value in column], dtype=np.int32))
+
+    def finish(self):
+        ids = np.concatenate(self.id_chunks) if self.id_chunks else np.array([], dtype=np.int64)
+        codes = {
+            field: np.concatenate(chunks) if chunks else np.array([], dtype=np.int32)
+            for field, chunks in self.code_chunks.items()
+        }
+        values = {field: list(table) for field, table in self.tables.items()}
+        return AlertColumns(ids, codes, values)
+
+def as_columns(data):
+    """Return fetched alerts as AlertColumns, encoding a list of row tuples if need be."""
+    return data if isinstance(data, AlertColumns) else AlertColumns.from_rows(data)
@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+import sklearn
+from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+from sklearn.neighbors import NearestNeighbors
+from atomic_file import write_atomic
+
+logger = logging.getLogger()
+
+# Fitted feature spaces and core-point models, one directory per version hash
+ARTIFACT_DIR = os.getenv("DBSCAN_ARTIFACT_DIR", "artifacts")
+
+# Bumped when the layout of a version directory changes; older versions are then ignored
+ARTIFACT_FORMAT = 2
+
+# Versions kept on disk besides the current one
+ARTIFACT_KEEP = 2
+
+# Points at the current version and carries the progress made since it was fitted
+STATE_FILE = "state.json"
+METADATA_FILE = "metadata.json"
+
+def version_hash(arrays, metadata):
+    """Hash the arrays and metadata of a fit; identical fits share a version."""
+    digest = hashlib.sha256(json.dumps(metadata, sort_keys=True).encode())
+    for name in sorted(arrays):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()[:16]
+
+def pack_clustering_state(state):
+    """Split a clustering state into plain numpy arrays and JSON metadata."""
+    feature_space = state["feature_space"]
+    arrays = {}
+    if feature_space["encoder"] == "tfidf":
+        for name in ("title_vectorizer", "tag_vectorizer"):
+            vectorizer = feature_space[name]
+            terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+            arrays[f"{name}_terms"] = np.array(terms, dtype=str)
+            arrays[f"{name}_idf"] = vectorizer.idf_
+        for index, encoder in enumerate(feature_space["label_encoders"]):
+            classes = np.array(encoder.classes_, dtype=str)
+            # A class that is not a string, e.g. None, would come back as another value and encode as unseen
+            if classes.tolist() != list(encoder.classes_):
+                raise ValueError(f"Label classes of encoder {index} do not round-trip through a string array.")
+            arrays[f"label_classes_{index}"] = classes
+    arrays["svd_components"] = feature_space["svd"].components_
+
+    for index, model in enumerate(state["core_models"]):
+        arrays[f"scaler_mean_{index}"] = model["scaler"].mean_
+        arrays[f"scaler_scale_{index}"] = model["scaler"].scale_
+        arrays[f"core_points_{index}"] = model["core_points"]
+        arrays[f"core_labels_{index}"] = model["core_labels"]
+
+    metadata = {
+        "format": ARTIFACT_FORMAT,
+        "sklearn": sklearn.__version__,
+        "encoder": feature_space["encoder"],
+        "encoder_settings": feature_space["encoder_settings"],
+        "label_encoders": len(feature_space.get("label_encoders", [])),
+        "eps": [float(model["eps"]) for model in state["core_models"]],
+        "fitted_at": state["last_full_fit"].isoformat(),
+        "high_water_mark": int(state["high_water_mark"]),
+    }
+    return arrays, metadata
+
+def unpack_vectorizer(arrays, name):
+    terms = arrays[f"{name}_terms"].tolist()
+    vectorizer = TfidfVectorizer(stop_words="english", vocabulary={term: index for index, term in enumerate(terms)})
+    vectorizer.idf_ = arrays[f"{name}_idf"]
+    return vectorizer
+
+def unpack_clustering_state(arrays, metadata):
+    """Rebuild the fitted transformers and core-point models from their arrays, without refitting."""
+    components = arrays["svd_components"]
+    svd = TruncatedSVD(n_components=components.shape[0])
+    svd.components_ = components
+    svd.n_features_in_ = components.shape[1]
+
+    core_models = []
+    for index, eps in enumerate(metadata["eps"]):
+        scaler = StandardScaler()
+        scaler.mean_ = arrays[f"scaler_mean_{index}"]
+        scaler.scale_ = arrays[f"scaler_scale_{index}"]
+        scaler.var_ = scaler.scale_ ** 2
+        scaler.n_features_in_ = len(scaler.mean_)
+        core_points = arrays[f"core_points_{index}"]
+        core_models.append({
+            "scaler": scaler,
+            "eps": eps,
+            "core_points": core_points,
+            "core_labels": arrays[f"core_labels_{index}"],
+            "index": NearestNeighbors(n_neighbors=1).fit(core_points) if len(core_points) else None,
+        })
+
+    feature_space = {"encoder": metadata["encoder"], "encoder_settings": metadata["encoder_settings"], "svd": svd}
+    if metadata["encoder"] == "tfidf":
+        label_encoders = []
+        for index in range(metadata["label_encoders"]):
+            encoder = LabelEncoder()
+            encoder.classes_ = arrays[f"label_classes_{index}"]
+            label_encoders.append(encoder)
+        feature_space["title_vectorizer"] = unpack_vectorizer(arrays, "title_vectorizer")
+        feature_space["tag_vectorizer"] = unpack_vectorizer(arrays, "tag_vectorizer")
+        feature_space["label_encoders"] = label_encoders
+    return feature_space, core_models
+
+def save_clustering_state(state):
+    """Store a freshly fitted clustering state under its version hash and make it current.
+
+    Each array is saved as its own .npy file so it can be memory-mapped on
+    load. The version directory is written under a temporary name and renamed
+    into place, then state.json is switched to it. Returns the version.
+    """
+    arrays, metadata = pack_clustering_state(state)
+    version = version_hash(arrays, metadata)
+    version_dir = os.path.join(ARTIFACT_DIR, version)
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+
+    if not os.path.isdir(version_dir):
+        temp_dir = f"{version_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temp_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_dir, f"{name}.npy"), array)
+        with open(os.path.join(temp_dir, METADATA_FILE), "w") as file:
+            json.dump(metadata, file)
+        os.replace(temp_dir, version_dir)
+
+    state["artifact_version"] = version
+    save_progress(state)
+    prune_versions(version)
+    logger.info(f"Saved feature space and {len(state['core_models'])} core-point models as version {version}.")
+    return version
+
+def save_progress(state):
+    """Record the incremental progress made on the current version."""
+    write_atomic(os.path.join(ARTIFACT_DIR, STATE_FILE), json.dumps({
+        "version": state["artifact_version"],
+        "high_water_mark": int(state["high_water_mark"]),
+        "last_full_fit": state["last_full_fit"].isoformat(),
+        "drift_rows": int(state["drift_rows"]),
+        "drift_unseen": int(state["drift_unseen"]),
+    }))
+
+def load_clustering_state(encoder_settings):
+    """Load the current version with its arrays memory-mapped. Returns None when there is none built with these encoder settings."""
+    state_path = os.path.join(ARTIFACT_DIR, STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path, "r") as file:
+            progress = json.load(file)
+        version_dir = os.path.join(ARTIFACT_DIR, progress["version"])
+        with open(os.path.join(version_dir, METADATA_FILE), "r") as file:
+            metadata = json.load(file)
+        if metadata["format"] != ARTIFACT_FORMAT or metadata["sklearn"] != sklearn.__version__:
+            logger.info(f"Ignoring feature space version {progress['version']} fitted with another format or scikit-learn.")
+            return None
+        if metadata["encoder_settings"] != encoder_settings:
+            logger.info(f"Ignoring feature space version {progress['version']} built with encoder settings {metadata['encoder_settings']}.")
+            return None
+
+        arrays = {
+            entry.name[:-len(".npy")]: np.load(entry.path, mmap_mode="r")
+            for entry in os.scandir(version_dir)
+            if entry.name.endswith(".npy")
+        }
+        feature_space, core_models = unpack_clustering_state(arrays, metadata)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Error loading feature space artifacts from {ARTIFACT_DIR}: {e}")
+        return None
+
+    logger.info(f"Loaded feature space version {progress['version']} fitted at {metadata['fitted_at']}.")
+    return {
+        "feature_space": feature_space,
+        "core_models": core_models,
+        "high_water_mark": progress["high_water_mark"],
+        "last_full_fit": datetime.fromisoformat(progress["last_full_fit"]),
+        "drift_rows": progress["drift_rows"],
+        "drift_unseen": progress["drift_unseen"],
+        "artifact_version": progress["version"],
+    }
+
+def prune_versions(current_version):
+    """Remove all but the newest ARTIFACT_KEEP versions besides the current one."""
+    versions = [
+        entry for entry in os.scandir(ARTIFACT_DIR)
+        if entry.is_dir() and entry.name != current_version and not entry.name.endswith(".tmp")
+    ]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[ARTIFACT_KEEP:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
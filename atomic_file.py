@@ -0,0 +1,15 @@
+import os
+import threading
+
+def write_atomic(path, text):
+    """Write text to a temporary file next to path, fsync it and rename it over path.
+
+    Readers see the old or the new content, never a partial write, and
+    concurrent writers in other threads or processes never share a temporary file.
+    """
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, path)
@@ -0,0 +1,39 @@
+"""Benchmark SQL.process_log_file on a synthetic Zircolite log.
+
+Usage: python benchmarks/bench_ingest.py [--size-mb 1024] [--raw-bytes 2048]
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SQL import process_log_file
+from benchmarks.generator import AlertGenerator, write_synthetic_log
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--raw-bytes", type=int, default=2048)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "zircolite.json")
+        lines = write_synthetic_log(path, size_mb=args.size_mb, generator=AlertGenerator(raw_bytes=args.raw_bytes))
+
+        start = time.perf_counter()
+        rows = batches = 0
+        for batch, _, _ in process_log_file(path, None):
+            rows += len(batch)
+            batches += 1
+        elapsed = time.perf_counter() - start
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"lines={lines} rows={rows} batches={batches} seconds={elapsed:.2f} "
+          f"rows_per_s={rows / elapsed:.0f} mb_per_s={args.size_mb / elapsed:.1f} peak_rss_mb={peak_rss_mb:.0f}")
+
+if __name__ == "__main__":
+    main()
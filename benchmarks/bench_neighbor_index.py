@@ -0,0 +1,50 @@
+"""Benchmark dbscan.run_dbscan with each neighbour index on synthetic alert features.
+
+Usage: python benchmarks/bench_neighbor_index.py [--sizes 10000 100000 1000000] [--indexes exact lsh grid]
+
+Label agreement is the adjusted Rand index against the exact index at the
+same size; the exact run is skipped above --exact-max-rows.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dbscan
+from neighbor_index import make_neighbor_index
+from benchmarks.generator import synthetic_features
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--indexes", nargs="+", default=["exact", "lsh", "grid"])
+    parser.add_argument("--exact-max-rows", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    for n_samples in args.sizes:
+        data = synthetic_features(n_samples)
+        reference = None
+        for name in args.indexes:
+            if name == "exact" and n_samples > args.exact_max_rows:
+                print(f"rows={n_samples} index=exact skipped")
+                continue
+            dbscan.neighbor_index = make_neighbor_index(name)
+
+            # Without tuned_params every run searches the full grid
+            start = time.perf_counter()
+            labels, _ = dbscan.run_dbscan(data, search_workers=args.workers)
+            elapsed = time.perf_counter() - start
+
+            if name == "exact":
+                reference = labels
+            agreement = f"{adjusted_rand_score(reference, labels):.4f}" if reference is not None else "n/a"
+            print(f"rows={n_samples} index={name} seconds={elapsed:.2f} clusters={len(set(labels) - {-1})} "
+                  f"noise={int(np.sum(labels == -1))} ari_vs_exact={agreement}", flush=True)
+
+if __name__ == "__main__":
+    main()
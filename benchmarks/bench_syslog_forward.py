@@ -0,0 +1,117 @@
+"""Measure SyslogForwarder end-to-end latency against a local stand-in collector.
+
+The forwarder is started before the collector so the first messages go
+through the spill file and replay path. Every message carries a sequence
+number; the script exits non-zero when a frame is malformed or a message
+never arrives. Replayed messages may arrive twice, which is allowed.
+
+Usage: python benchmarks/bench_syslog_forward.py [--messages 10000]
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import syslog_forwarder
+from syslog_forwarder import SyslogForwarder, FACILITY, SEVERITY
+
+# One octet-counted frame's payload: RFC 5424 header, then the CEF message the benchmark sent
+FRAME_PATTERN = re.compile(
+    rb"<%d>1 \S+ \S+ anomalyhunter \d+ - - CEF:0\|Sigma\|UEBA\|1\.0\|1\|\w+\|5\| seq=(\d+) sent=([\d.]+)" % (FACILITY * 8 + SEVERITY)
+)
+
+def message(seq, name):
+    return f"CEF:0|Sigma|UEBA|1.0|1|{name}|5| seq={seq} sent={time.perf_counter()}"
+
+class Collector:
+    """Local TCP syslog listener checking octet-counted frames and recording arrival latency."""
+
+    def __init__(self):
+        self.latencies = []
+        self.received = 0
+        self.sequences = set()
+        self.malformed = 0
+
+    async def handle(self, reader, writer):
+        while True:
+            try:
+                header = await reader.readuntil(b" ")
+            except asyncio.IncompleteReadError as e:
+                self.malformed += bool(e.partial)  # Bytes left over after the last whole frame
+                break
+            try:
+                frame = await reader.readexactly(int(header))
+            except (asyncio.IncompleteReadError, ValueError):
+                self.malformed += 1
+                break
+            match = FRAME_PATTERN.fullmatch(frame)
+            if match is None:
+                self.malformed += 1
+                continue
+            self.latencies.append(time.perf_counter() - float(match.group(2)))
+            self.sequences.add(int(match.group(1)))
+            self.received += 1
+        writer.close()
+
+def run_collector(collector, port, started, stop):
+    async def main():
+        server = await asyncio.start_server(collector.handle, "127.0.0.1", port)
+        started.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        server.close()
+    asyncio.run(main())
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=15514)
+    args = parser.parse_args()
+
+    syslog_forwarder.BACKOFF_MAX = 0.5
+    with tempfile.TemporaryDirectory() as temp_dir:
+        forwarder = SyslogForwarder("127.0.0.1", args.port, spill_path=os.path.join(temp_dir, "spill.log"))
+        forwarder.start()
+
+        # Collector down: these messages are spilled and replayed
+        outage = min(100, args.messages)
+        forwarder.send([message(seq, "outage") for seq in range(outage)])
+        time.sleep(1)
+
+        collector = Collector()
+        started, stop = threading.Event(), threading.Event()
+        threading.Thread(target=run_collector, args=(collector, args.port, started, stop), daemon=True).start()
+        started.wait()
+
+        start = time.perf_counter()
+        for seq in range(outage, args.messages):
+            forwarder.send([message(seq, "bench")])
+        deadline = time.time() + 30
+        while len(collector.sequences) < args.messages and time.time() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        forwarder.stop()
+        stop.set()
+
+    live = collector.latencies[-(args.messages - outage):]
+    print(f"received={collector.received}/{args.messages} spilled={forwarder.spilled} seconds={elapsed:.2f} "
+          f"msgs_per_s={collector.received / elapsed:.0f} "
+          f"latency_p50_ms={percentile(live, 0.5) * 1000:.2f} latency_p99_ms={percentile(live, 0.99) * 1000:.2f}")
+
+    missing = args.messages - len(collector.sequences)
+    if missing or collector.malformed:
+        print(f"FAILED: missing={missing} malformed={collector.malformed}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
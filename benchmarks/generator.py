@@ -0,0 +1,133 @@
+"""Synthetic Zircolite alerts for the benchmarks.
+
+Lines have the shape SQL.process_log_file expects. Cardinality of hosts and
+users, the share of exact repeats on the clustered columns and the size of
+the raw payload are configurable, so the same generator can mimic a small
+lab or a large AD estate.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+import numpy as np
+
+TITLES = [
+    "Suspicious PowerShell Download Cradle",
+    "Mimikatz Use",
+    "Failed Logon From Public IP",
+    "New Service Created",
+    "Rare Scheduled Task Creation",
+    "Encoded PowerShell Command Line",
+    "LSASS Memory Access",
+    "Remote Thread Creation In Uncommon Target",
+]
+TAGS = [
+    ["attack.execution", "attack.t1059.001"],
+    ["attack.credential_access", "attack.t1003"],
+    ["attack.persistence", "attack.t1543.003"],
+    ["attack.defense_evasion", "attack.t1027"],
+    ["attack.lateral_movement", "attack.t1021"],
+]
+PROVIDERS = ["Microsoft-Windows-Sysmon", "Microsoft-Windows-Security-Auditing", "Service Control Manager"]
+EVENT_IDS = [1, 4624, 4625, 4688, 7045, 10]
+
+# Repeats are drawn from this many recent alerts
+RECENT_ALERTS = 1000
+
+class AlertGenerator:
+    """Generate alerts with a given host and user cardinality and share of exact repeats."""
+
+    def __init__(self, hosts=500, users=5000, duplicate_ratio=0.8, raw_bytes=2048, seed=0):
+        self.rng = random.Random(seed)
+        self.hosts = hosts
+        self.users = users
+        self.duplicate_ratio = duplicate_ratio
+        self.raw_bytes = raw_bytes
+        self.recent = []
+        self.time = datetime(2024, 5, 1)
+
+    def fields(self):
+        """Clustered columns of the next alert: a repeat of a recent one or a fresh draw."""
+        rng = self.rng
+        if self.recent and rng.random() < self.duplicate_ratio:
+            return rng.choice(self.recent)
+        fields = (
+            rng.choice(TITLES),
+            rng.choice(TAGS),
+            f"HOST{rng.randint(1, self.hosts)}.corp.local",
+            f"S-1-5-21-{rng.randint(1, self.users)}",
+            rng.choice(EVENT_IDS),
+            rng.choice(PROVIDERS),
+        )
+        if len(self.recent) < RECENT_ALERTS:
+            self.recent.append(fields)
+        else:
+            self.recent[rng.randrange(RECENT_ALERTS)] = fields
+        return fields
+
+    def alert(self):
+        """The clustered columns and the Zircolite JSON line, with a padded CommandLine field, of the next alert."""
+        fields = self.fields()
+        title, tags, computer, user, event_id, provider = fields
+        self.time += timedelta(milliseconds=self.rng.randint(1, 50))
+        line = json.dumps({
+            "title": title,
+            "id": "0d894093-71bc-43c3-8c4d-ecfc28dcf5d9",
+            "description": "Detects a suspicious \"pattern\" in process creation events",
+            "tags": tags,
+            "rule_level": "high",
+            "count": 1,
+            "matches": [{
+                "row_id": self.rng.randint(1, 10 ** 6),
+                "SystemTime": self.time.strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z",
+                "Computer": computer,
+                "UserID": user,
+                "EventID": event_id,
+                "Provider_Name": provider,
+                "CommandLine": "x" * self.rng.randint(self.raw_bytes // 2, self.raw_bytes),
+            }],
+        }, separators=(",", ":")) + "\n"
+        return fields, line
+
+    def line(self):
+        return self.alert()[1]
+
+    def rows(self, count):
+        """Rows as process_log_file yields them and insert_data_to_sql takes them."""
+        rows = []
+        for _ in range(count):
+            (title, tags, computer, user, event_id, provider), line = self.alert()
+            rows.append((title, ",".join(tags), "Detects a suspicious pattern", self.time.strftime("%Y-%m-%d %H:%M:%S"),
+                         computer, user, str(event_id), provider, line.rstrip("\n")))
+        return rows
+
+def write_synthetic_log(path, size_mb=None, lines=None, generator=None):
+    """Write synthetic lines to path until it reaches size_mb or holds the given number of lines; return the line count."""
+    generator = generator or AlertGenerator()
+    target = size_mb * 1024 * 1024 if size_mb else None
+    written = count = 0
+    with open(path, "w") as file:
+        while (target is None or written < target) and (lines is None or count < lines):
+            line = generator.line()
+            file.write(line)
+            written += len(line)
+            count += 1
+    return count
+
+def alert_rows(rows, first_id=1):
+    """sigma_alerts rows in the shape dbscan.fetch_data returns: (id, title, tags, computer, user, event id, provider)."""
+    return [(first_id + index, row[0], row[1], row[4], row[5], row[6], row[7]) for index, row in enumerate(rows)]
+
+def anomaly_rows(rows, first_id=1):
+    """sigma_alerts rows in the shape logger.fetch_anomalies returns, all labelled as noise."""
+    return [(first_id + index, *row[:8], -1, row[8]) for index, row in enumerate(rows)]
+
+def synthetic_features(n_samples, n_features=50, cluster_size=50, noise_share=0.02, duplicate_share=0.1, seed=0):
+    """Reduced alert features: tight clusters of recurring alerts, scattered noise and exact repeats."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-5, 5, (max(1, n_samples // cluster_size), n_features))
+    data = centers[rng.integers(0, len(centers), n_samples)] + rng.normal(0, 0.03, (n_samples, n_features))
+    n_noise = int(n_samples * noise_share)
+    data[:n_noise] = rng.uniform(-5, 5, (n_noise, n_features))
+    n_duplicates = int(n_samples * duplicate_share)
+    data[n_samples - n_duplicates:] = data[rng.integers(0, n_samples - n_duplicates, n_duplicates)]
+    return data
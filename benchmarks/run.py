@@ -0,0 +1,196 @@
+"""Time the pipeline stages on synthetic alerts and write machine-readable results.
+
+Usage: python benchmarks/run.py [--sizes 10000 100000 1000000] [--stages parse insert ...]
+                                [--output results.json] [--compare baseline.json] [--mysql]
+
+Each stage and size runs in its own process, so peak RSS is per measurement.
+Database stages use an in-process stand-in unless --mysql is given, in which
+case they write to the database configured through DB_HOST/DB_NAME; point it
+at a scratch database.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from queue import Empty
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generator import AlertGenerator, write_synthetic_log, alert_rows, anomaly_rows
+from benchmarks.stand_in import stand_in_database
+from alert_columns import AlertColumns
+
+STAGES = ["parse", "insert", "preprocess", "dbscan", "write_back", "cef"]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def prepare(stage, rows, args, work_dir):
+    """Build the stage's input outside the timed section and return the timed callable."""
+    generator = AlertGenerator(hosts=args.hosts, users=args.users, duplicate_ratio=args.duplicate_ratio, raw_bytes=args.raw_bytes)
+
+    if stage == "parse":
+        from SQL import process_log_file
+        path = os.path.join(work_dir, "zircolite.json")
+        write_synthetic_log(path, lines=rows, generator=generator)
+        return lambda: sum(len(batch) for batch, _, _ in process_log_file(path, None))
+
+    if stage == "insert":
+        from SQL import insert_data_to_sql
+        data = generator.rows(rows)
+        return lambda: insert_data_to_sql(data, "sigma_alerts", "benchmark")
+
+    if stage in ("preprocess", "dbscan"):
+        import dbscan
+        # fetch_data hands preprocess_data dictionary-encoded columns
+        data = AlertColumns.from_rows(alert_rows(generator.rows(rows)))
+        if stage == "preprocess":
+            return lambda: dbscan.preprocess_data(data)
+        # Distinct feature rows weighted by their alert count, as cluster_all_alerts clusters them
+        unique_data, _, counts = dbscan.deduplicate(data)
+        reduced, _ = dbscan.preprocess_data(unique_data, sample_weight=counts)
+        return lambda: dbscan.run_dbscan(reduced, search_workers=args.workers, sample_weight=counts)
+
+    if stage == "write_back":
+        import dbscan
+        data = AlertColumns.from_rows(alert_rows(generator.rows(rows)))
+        labels = np.random.default_rng(0).integers(-1, 100, len(data))
+        return lambda: dbscan.update_cluster_labels(data, labels)
+
+    if stage == "cef":
+        import logger as export
+        from cef_writer import CefWriter
+        anomalies = anomaly_rows(generator.rows(rows))
+        export.cef_log = CefWriter(os.path.join(work_dir, "anomaly.syslog"))
+        export.CEF_FILE_OUTPUT = True
+        return lambda: export.write_to_cef(anomalies)
+
+    raise ValueError(f"Unknown stage '{stage}'")
+
+def measure(stage, rows, args, results):
+    """Run one stage at one size in this (child) process and put its measurement on the results queue."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        run = prepare(stage, rows, args, work_dir)
+        # The stage modules configure INFO logging on import
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+        input_rss = peak_rss_mb()
+        if args.mysql:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        else:
+            with stand_in_database():
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+    results.put({
+        "stage": stage,
+        "rows": rows,
+        "seconds": round(elapsed, 4),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "input_rss_mb": round(input_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    })
+
+def wait_for_result(child, results):
+    """Return the child's measurement, or None when it exits without one.
+
+    The queue is read before the child is joined: a child only exits once
+    its queued data has been read, so joining first can deadlock.
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            if not child.is_alive():
+                break
+    try:
+        return results.get(timeout=1)  # Put just before the child exited
+    except Empty:
+        return None
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline_path, tolerance):
+    """Print rows/s and peak RSS against a baseline run; return the number of regressions."""
+    with open(baseline_path) as file:
+        baseline = {(entry["stage"], entry["rows"]): entry for entry in json.load(file)["results"]}
+    regressions = 0
+    for entry in results:
+        before = baseline.get((entry["stage"], entry["rows"]))
+        if not before or not before["rows_per_s"] or not entry["rows_per_s"]:
+            continue
+        speed = entry["rows_per_s"] / before["rows_per_s"] - 1
+        memory = entry["peak_rss_mb"] / before["peak_rss_mb"] - 1
+        regressed = speed < -tolerance or memory > tolerance
+        regressions += regressed
+        print(f"{'REGRESSION' if regressed else 'ok':10} stage={entry['stage']} rows={entry['rows']} "
+              f"rows_per_s={speed:+.1%} peak_rss_mb={memory:+.1%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--max-dbscan-rows", type=int, default=100000, help="skip run_dbscan above this size")
+    parser.add_argument("--hosts", type=int, default=500)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.8)
+    parser.add_argument("--raw-bytes", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--mysql", action="store_true", help="run database stages against MySQL instead of the stand-in")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("fork")
+    results = []
+    for rows in args.sizes:
+        for stage in args.stages:
+            if stage == "dbscan" and rows > args.max_dbscan_rows:
+                print(f"stage={stage} rows={rows} skipped")
+                continue
+            queue = context.Queue()
+            child = context.Process(target=measure, args=(stage, rows, args, queue))
+            child.start()
+            entry = wait_for_result(child, queue)
+            child.join()
+            if entry is None or child.exitcode != 0:
+                print(f"stage={stage} rows={rows} failed with exit code {child.exitcode}")
+                continue
+            results.append(entry)
+            print(" ".join(f"{key}={value}" for key, value in entry.items()), flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "database": "mysql" if args.mysql else "stand-in",
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
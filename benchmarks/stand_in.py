@@ -0,0 +1,103 @@
+"""In-process stand-in for the MySQL statements the benchmarked stages run.
+
+It keeps sigma_alerts ids, ingest batches and cluster labels in memory and
+answers the handful of statements insert_data_to_sql and
+update_cluster_labels issue, so those stages can be timed without a server.
+The timings then cover the Python side only: row building, chunking and
+parameter flattening, not the server or the wire.
+"""
+from contextlib import contextmanager
+import db
+
+ROW_COLUMNS = 10  # Columns of one INSERT INTO sigma_alerts row
+
+class StandInDatabase:
+    def __init__(self):
+        self.next_alert_id = 1
+        self.next_batch_id = 1
+        self.batch_ids = {}
+        self.labels = {}
+        self.staging = []
+        self.statements = 0
+
+class StandInCursor:
+    def __init__(self, database):
+        self.database = database
+        self.lastrowid = None
+        self.rowcount = 0
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=()):
+        database = self.database
+        database.statements += 1
+        query = " ".join(query.split())
+        if query.startswith("INSERT INTO ingest_batches"):
+            self.lastrowid = database.next_batch_id
+            database.next_batch_id += 1
+        elif query.startswith("INSERT INTO sigma_alerts"):
+            self.insert_alerts(len(params) // ROW_COLUMNS, params[ROW_COLUMNS - 2] if params else None)
+        elif query.startswith("SELECT id FROM sigma_alerts WHERE ingest_batch_id"):
+            self.result = [(alert_id,) for alert_id in database.batch_ids.get(params[0], [])]
+        elif query.startswith("DELETE FROM dbscan_cluster_staging"):
+            database.staging = []
+        elif query.startswith("SELECT MIN(alerts.id) FROM sigma_alerts AS alerts JOIN dbscan_cluster_staging"):
+            new_anomalies = [alert_id for alert_id, label in database.staging if label == -1 and database.labels.get(alert_id) != -1]
+            self.result = [(min(new_anomalies, default=None),)]
+        elif query.startswith("UPDATE sigma_alerts AS alerts JOIN dbscan_cluster_staging"):
+            changed = [(alert_id, label) for alert_id, label in database.staging if database.labels.get(alert_id) != label]
+            database.labels.update(changed)
+            self.rowcount = len(changed)
+
+    def executemany(self, query, seq_params):
+        seq_params = list(seq_params)
+        self.database.statements += 1
+        if query.startswith("INSERT INTO dbscan_cluster_staging"):
+            self.database.staging.extend(seq_params)
+        elif "INSERT INTO sigma_alerts" in query and seq_params:
+            self.insert_alerts(len(seq_params), seq_params[0][ROW_COLUMNS - 2])
+
+    def insert_alerts(self, count, batch_id):
+        database = self.database
+        ids = list(range(database.next_alert_id, database.next_alert_id + count))
+        database.next_alert_id += count
+        database.batch_ids.setdefault(batch_id, []).extend(ids)
+        self.lastrowid = ids[0] if ids else None
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        result, self.result = self.result, []
+        return result
+
+class StandInConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, buffered=None):
+        return StandInCursor(self.database)
+
+    def commit(self):
+        pass
+
+@contextmanager
+def stand_in_database():
+    """Route db.connection() to a fresh in-memory stand-in for the duration of the block."""
+    database = StandInDatabase()
+
+    @contextmanager
+    def connection():
+        yield StandInConnection(database)
+
+    original = db.connection
+    db.connection = connection
+    try:
+        yield database
+    finally:
+        db.connection = original
@@ -0,0 +1,118 @@
+import os
+import glob
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger()
+
+# Rotation thresholds for the CEF log
+CEF_MAX_BYTES = int(os.getenv("CEF_MAX_BYTES", str(100 * 1024 * 1024)))
+CEF_ROTATE_SECONDS = int(os.getenv("CEF_ROTATE_SECONDS", "3600"))
+
+# Seconds between throughput reports
+STATS_INTERVAL = 60
+
+# Suffix of rotated files; they no longer match rsyslog's *.syslog pattern
+ROTATED_SUFFIX_FORMAT = "%Y%m%d-%H%M%S"
+
+def escape_header(value):
+    """Escape a CEF header field: backslashes and pipes, with line breaks flattened."""
+    value = "" if value is None else str(value)
+    return value.replace("\\", "\\\\").replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+
+def escape_extension(value):
+    """Escape a CEF extension value: backslashes, equals signs and line breaks."""
+    value = "" if value is None else str(value)
+    return value.replace("\\", "\\\\").replace("=", "\\=").replace("\r\n", "\\n").replace("\r", "\\n").replace("\n", "\\n")
+
+def format_cef_event(anomaly):
+    """Format a sigma_alerts anomaly row as a single-line CEF event."""
+    return (
+        f"CEF:0|Sigma|UEBA|1.0|{escape_header(anomaly[7])}|{escape_header(anomaly[1])}|5|"
+        f"end={escape_extension(anomaly[4])} rt={escape_extension(anomaly[4])} "
+        f"suser={escape_extension(anomaly[6])} dvc={escape_extension(anomaly[5])} "
+        f"msg={escape_extension(anomaly[3])} cs1={escape_extension(anomaly[8])} cs1Label=ProviderName "
+        f"cs2={escape_extension(anomaly[2])} cs2Label=Tags cs3={escape_extension(anomaly[9])} cs3Label=DBScanCluster "
+        f"cs4={escape_extension(anomaly[10])} cs4Label=Raw"
+    )
+
+def rotate_file(path):
+    """Rename the log to a timestamped segment; the next write starts a new file that rsyslog imfile picks up."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    rotated_path = f"{path}.{datetime.now().strftime(ROTATED_SUFFIX_FORMAT)}"
+    counter = 1
+    while os.path.exists(rotated_path):
+        rotated_path = f"{path}.{datetime.now().strftime(ROTATED_SUFFIX_FORMAT)}-{counter}"
+        counter += 1
+    os.rename(path, rotated_path)
+    logger.info(f"Rotated {path} to {rotated_path}.")
+    return rotated_path
+
+def remove_rotated(path, max_age_seconds):
+    """Delete rotated segments of the log last written more than max_age_seconds ago."""
+    cutoff = time.time() - max_age_seconds
+    for rotated_path in glob.glob(f"{glob.escape(path)}.*"):
+        if os.path.getmtime(rotated_path) < cutoff:
+            os.remove(rotated_path)
+            logger.info(f"Removed rotated log {rotated_path}.")
+
+class CefWriter:
+    """Append CEF events to a file in batches, rotating it by size and age.
+
+    Each batch is written with one write call and made durable with one fsync.
+    The file is opened per batch, so a rotation done by another process is
+    picked up on the next batch. Like logging's TimedRotatingFileHandler, the
+    age of an existing file is measured from its mtime at start-up.
+    """
+
+    def __init__(self, path, max_bytes=CEF_MAX_BYTES, rotate_seconds=CEF_ROTATE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        start = os.path.getmtime(path) if os.path.exists(path) else time.time()
+        self.rollover_at = start + rotate_seconds
+        self.rows = 0
+        self.bytes = 0
+        self.stats_since = time.monotonic()
+
+    def should_rotate(self, pending_bytes):
+        if time.time() >= self.rollover_at:
+            return True
+        try:
+            return os.path.getsize(self.path) + pending_bytes > self.max_bytes
+        except FileNotFoundError:
+            return False
+
+    def write_batch(self, events):
+        """Write a batch of CEF events with a single write and fsync."""
+        if not events:
+            return
+        data = ("\n".join(events) + "\n").encode("utf-8", errors="replace")
+        if self.should_rotate(len(data)):
+            rotate_file(self.path)
+            self.rollover_at = time.time() + self.rotate_seconds
+
+        with open(self.path, "ab") as cef_file:
+            cef_file.write(data)
+            cef_file.flush()
+            os.fsync(cef_file.fileno())
+
+        self.rows += len(events)
+        self.bytes += len(data)
+        self.report()
+
+    def report(self, force=False):
+        """Log rows and bytes per second written since the last report."""
+        elapsed = time.monotonic() - self.stats_since
+        if not force and elapsed < STATS_INTERVAL:
+            return
+        if self.rows:
+            logger.info(
+                f"Exported {self.rows} CEF events ({self.bytes} bytes) in {elapsed:.0f} s: "
+                f"{self.rows / elapsed:.1f} rows/s, {self.bytes / elapsed:.0f} bytes/s."
+            )
+        self.rows = 0
+        self.bytes = 0
+        self.stats_since = time.monotonic()
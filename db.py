@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from mysql.connector import Error, errors
+from mysql.connector.pooling import MySQLConnectionPool
+
+logger = logging.getLogger()
+
+# Database configuration (Using environment variables for security)
+db_config = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "sigma"),
+    "password": os.getenv("DB_PASSWORD", "sigma"),
+    "database": os.getenv("DB_NAME", "sigma_db"),
+}
+
+# Connection pool sizing (mysql-connector allows at most 32 connections per pool)
+POOL_SIZE = min(32, int(os.getenv("DB_POOL_SIZE", "10")))
+POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "30"))
+
+# Reconnect attempts and exponential backoff when the server is unreachable
+CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+BACKOFF_INITIAL = 0.1
+BACKOFF_MAX = 5.0
+
+# Pool metrics, read with pool_stats()
+pool_metrics = {
+    "checkouts": 0,
+    "in_use": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+    "exhausted_waits": 0,
+    "connect_failures": 0,
+}
+metrics_lock = threading.Lock()
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    """Create the process-wide connection pool on first use, retrying with backoff."""
+    global pool
+    with pool_lock:
+        delay = BACKOFF_INITIAL
+        for attempt in range(1, CONNECT_RETRIES + 1):
+            if pool is not None:
+                return pool
+            try:
+                pool = MySQLConnectionPool(pool_name=f"anomalyhunter_{os.getpid()}", pool_size=POOL_SIZE, **db_config)
+                logger.info(f"Created MySQL connection pool with {POOL_SIZE} connections.")
+            except Error as e:
+                with metrics_lock:
+                    pool_metrics["connect_failures"] += 1
+                if attempt == CONNECT_RETRIES:
+                    raise
+                logger.error(f"Error creating connection pool (attempt {attempt}/{CONNECT_RETRIES}): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
+        return pool
+
+def checkout():
+    """Get a live connection from the pool.
+
+    The pool pings a connection before handing it out and reconnects it when
+    the server dropped it. An exhausted pool is waited on for up to
+    POOL_WAIT_TIMEOUT seconds; a failing server is retried CONNECT_RETRIES
+    times, both with exponential backoff.
+    """
+    start = time.monotonic()
+    delay = BACKOFF_INITIAL
+    failures = 0
+    while True:
+        try:
+            connection = get_pool().get_connection()
+            break
+        except errors.PoolError:
+            with metrics_lock:
+                pool_metrics["exhausted_waits"] += 1
+            if time.monotonic() - start >= POOL_WAIT_TIMEOUT:
+                raise
+        except (errors.InterfaceError, errors.OperationalError) as e:
+            failures += 1
+            with metrics_lock:
+                pool_metrics["connect_failures"] += 1
+            if failures >= CONNECT_RETRIES:
+                raise
+            logger.error(f"Error checking out a database connection (attempt {failures}/{CONNECT_RETRIES}): {e}")
+        time.sleep(delay)
+        delay = min(delay * 2, BACKOFF_MAX)
+
+    waited = time.monotonic() - start
+    with metrics_lock:
+        pool_metrics["checkouts"] += 1
+        pool_metrics["in_use"] += 1
+        pool_metrics["wait_seconds_total"] += waited
+        pool_metrics["wait_seconds_max"] = max(pool_metrics["wait_seconds_max"], waited)
+    return connection
+
+@contextmanager
+def connection():
+    """Check out a pooled connection for the duration of a with block and return it afterwards."""
+    pooled = checkout()
+    try:
+        yield pooled
+    finally:
+        with metrics_lock:
+            pool_metrics["in_use"] -= 1
+        try:
+            pooled.close()  # Returns the connection to the pool
+        except Error as e:
+            logger.error(f"Error returning connection to the pool: {e}")
+
+def pool_stats():
+    """Return a snapshot of the pool metrics."""
+    with metrics_lock:
+        stats = dict(pool_metrics)
+    stats["pool_size"] = POOL_SIZE
+    return stats
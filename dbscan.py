@@ -1,197 +1,828 @@
 import os
+import json
 import logging
+import tempfile
 import schedule
 import time
 from datetime import datetime
-import mysql.connector
 from mysql.connector import Error
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.cluster import DBSCAN
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import PCA
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.decomposition import TruncatedSVD
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import psutil  # For monitoring system resources
 from sklearn.metrics import silhouette_score  # For evaluating clustering
+from sklearn.neighbors import NearestNeighbors
+from threadpoolctl import threadpool_limits
+import db
+import metrics
+import artifacts
+from atomic_file import write_atomic
+from alert_columns import AlertColumnsBuilder, as_columns
+from neighbor_index import make_neighbor_index
+from events import ALERTS_INGESTED, ALERTS_CLUSTERED, EventListener, publish
+from stream_clustering import MicroClusterModel
+from migrations import apply_migrations
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Database configuration
-db_config = {
-    "host": "localhost",
-    "user": "sigma",
-    "password": "sigma",
-    "database": "sigma_db",
+# Incremental clustering: between full re-fits only rows without a cluster
+# label (dbscan_cluster IS NULL) are fetched and assigned to the existing clusters
+INCREMENTAL_CLUSTERING = os.getenv("DBSCAN_INCREMENTAL", "true").lower() == "true"
+FULL_REFIT_MINUTES = int(os.getenv("DBSCAN_FULL_REFIT_MINUTES", "60"))
+
+# Clustering mode: "batch" re-fits DBSCAN on the table, "stream" absorbs new
+# alerts into decaying micro-clusters and reclusters their centres
+CLUSTERING_MODE = os.getenv("DBSCAN_MODE", "batch").lower()
+STREAM_BOOTSTRAP_ROWS = int(os.getenv("DBSCAN_STREAM_BOOTSTRAP_ROWS", "50000"))
+STREAM_POLL_SECONDS = 2
+STREAM_RECLUSTER_SECONDS = int(os.getenv("DBSCAN_STREAM_RECLUSTER_SECONDS", "60"))
+
+# Feature encoding: "tfidf" fits vocabularies and label encoders, "hashing"
+# hashes text and categorical fields into a fixed width without fitting
+FEATURE_ENCODER = os.getenv("DBSCAN_ENCODER", "tfidf").lower()
+TEXT_HASH_FEATURES = int(os.getenv("DBSCAN_TEXT_HASH_FEATURES", str(2 ** 14)))
+CATEGORY_HASH_FEATURES = int(os.getenv("DBSCAN_CATEGORY_HASH_FEATURES", str(2 ** 16)))
+TEXT_HASHER = HashingVectorizer(n_features=TEXT_HASH_FEATURES, stop_words="english", alternate_sign=False)
+CATEGORY_HASHER = FeatureHasher(n_features=CATEGORY_HASH_FEATURES, input_type="string")
+ENCODER_SETTINGS = (
+    {"encoder": "hashing", "text_hash_features": TEXT_HASH_FEATURES, "category_hash_features": CATEGORY_HASH_FEATURES}
+    if FEATURE_ENCODER == "hashing" else {"encoder": "tfidf"}
+)
+
+# Drift check: re-fit early once this share of the alerts assigned since the
+# last fit carried categorical values the fitted encoders have not seen
+DRIFT_THRESHOLD = float(os.getenv("DBSCAN_DRIFT_THRESHOLD", "0.2"))
+DRIFT_MIN_ROWS = 1000
+
+# Fitted feature space and core-point models kept between runs and persisted by artifacts.py
+clustering_state = {
+    "feature_space": None,
+    "core_models": [],
+    "high_water_mark": 0,
+    "last_full_fit": None,
+    "drift_rows": 0,
+    "drift_unseen": 0,
+    "artifact_version": None,
 }
 
-def fetch_data():
-    """Fetch data from the sigma_alerts table."""
+# Feature space, scaler and micro-clusters of the streaming mode
+stream_state = {
+    "feature_space": None,
+    "scaler": None,
+    "model": None,
+    "low_water_mark": 0,
+    "last_recluster": 0.0,
+}
+
+# DBSCAN parameter search
+EPS_CANDIDATES = [round(eps, 1) for eps in np.arange(0.1, 1.0, 0.1)]
+MIN_SAMPLES_CANDIDATES = list(range(2, 10))
+SILHOUETTE_SAMPLE_SIZE = int(os.getenv("DBSCAN_SILHOUETTE_SAMPLE_SIZE", "2000"))
+SEARCH_WORKERS = int(os.getenv("DBSCAN_SEARCH_WORKERS", str(os.cpu_count())))
+# min_samples candidates of one eps tried after the best score stopped improving; 0 tries them all
+SEARCH_PATIENCE = int(os.getenv("DBSCAN_SEARCH_PATIENCE", "2"))
+
+# Region queries of the parameter search go through this index (DBSCAN_NEIGHBOR_INDEX)
+neighbor_index = make_neighbor_index()
+
+# Batch clustering backend: "process", "thread" or "serial"
+CLUSTER_EXECUTOR = os.getenv("DBSCAN_EXECUTOR", "process").lower()
+CLUSTER_WORKERS = int(os.getenv("DBSCAN_WORKERS", str(os.cpu_count())))
+
+# Rows read per fetchmany() when streaming alerts out of sigma_alerts
+FETCH_CHUNK_ROWS = int(os.getenv("DBSCAN_FETCH_CHUNK_ROWS", "10000"))
+
+# Rows per staged chunk when writing cluster labels back
+WRITE_BACK_CHUNK_SIZE = int(os.getenv("DBSCAN_WRITE_BACK_CHUNK_SIZE", "10000"))
+
+# Memory-mapped feature matrix and BLAS limits of a batch worker process
+batch_worker_state = {}
+
+# Tuned parameters of the last search, used to warm-start the next one
+tuned_params_file = "dbscan_params.json"
+
+# Neighbour graph and scaled data handed to each search worker process
+search_state = {}
+
+@metrics.timed("fetch")
+def fetch_data(min_id=None, unlabelled=False):
+    """Fetch alerts as AlertColumns, optionally only rows with id > min_id and/or without a cluster label."""
+    builder = AlertColumnsBuilder()
     try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db.connection() as connection, connection.cursor(buffered=False) as cursor:
             select_query = """
             SELECT id, title, tags, computer_name, user_id, event_id, provider_name
             FROM sigma_alerts
             """
-            cursor.execute(select_query)
-            data = cursor.fetchall()
+            conditions = []
+            params = ()
+            if min_id is not None:
+                conditions.append("id > %s")
+                params = (min_id,)
+            if unlabelled:
+                # Through idx_dbscan_cluster; unlike an id watermark this also finds rows committed late with a lower id
+                conditions.append("dbscan_cluster IS NULL")
+            if conditions:
+                select_query += " WHERE " + " AND ".join(conditions)
+            cursor.execute(select_query, params)
+            # Unbuffered: rows are encoded chunk by chunk, so only one chunk of tuples is held at a time
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+                if not rows:
+                    break
+                builder.extend(rows)
+        data = builder.finish()
+        metrics.inc("rows_fetched_total", len(data))
         return data
     except Error as e:
         logging.error(f"Error fetching data: {e}")
-        return []
-    finally:
-        if connection.is_connected():
-            connection.close()
+        return AlertColumnsBuilder().finish()
+
+# NULL categorical values are encoded as this value, which survives the string arrays artifacts.py stores classes in
+NULL_CATEGORY = ""
+
+def category_values(values):
+    return [NULL_CATEGORY if value is None else value for value in values]
+
+def encode_labels(encoder, values):
+    """Encode values with a fitted LabelEncoder, mapping unseen values to one extra code."""
+    codes = {label: index for index, label in enumerate(encoder.classes_)}
+    unknown = len(codes)
+    return np.array([codes.get(value, unknown) for value in category_values(values)])
+
+# Categorical fields and the prefix of their field=value tokens for the feature hasher
+CATEGORICAL_FIELDS = (("computer_name", "computer"), ("user_id", "user"), ("event_id", "event"), ("provider_name", "provider"))
+
+def fit_tfidf(values, counts):
+    """Fit a TF-IDF vectorizer on distinct values as if each occurred counts[i] times."""
+    # The vocabulary only depends on which values occur; weighting the document frequencies gives the idf of every row
+    vectorizer = TfidfVectorizer(stop_words="english").fit(values)
+    present = (vectorizer.transform(values) > 0).astype(np.float64)
+    document_frequency = present.T @ counts
+    n_documents = counts.sum()
+    # Smoothed idf, as TfidfTransformer computes it
+    vectorizer.idf_ = np.log((1 + n_documents) / (1 + document_frequency)) + 1
+    return vectorizer
+
+@metrics.timed("preprocess")
+def preprocess_data(data, feature_space=None, sample_weight=None):
+    """Reduce alerts to DBSCAN features in feature_space, fitting one (weighted by sample_weight) when it is None."""
+    data = as_columns(data)
+    # Encoders run once per distinct value of a field and are fanned out to the rows by their codes
+    codes, values = data.codes, data.values
+    titles = [value or "" for value in values["title"]]
+    tags = [value or "" for value in values["tags"]]
+
+    # Hashed features keep no state, so only the SVD is fitted and memory does not grow with hosts and users
+    if feature_space is None and FEATURE_ENCODER == "hashing":
+        feature_space = {"encoder": "hashing", "encoder_settings": ENCODER_SETTINGS}
+    elif feature_space is None:
+        feature_space = {
+            "encoder": "tfidf",
+            "encoder_settings": ENCODER_SETTINGS,
+            "title_vectorizer": fit_tfidf(titles, data.counts("title", sample_weight)),
+            "tag_vectorizer": fit_tfidf(tags, data.counts("tags", sample_weight)),
+            "label_encoders": [LabelEncoder().fit(category_values(values[field])) for field, _ in CATEGORICAL_FIELDS],
+        }
+
+    if feature_space["encoder"] == "hashing":
+        # The hasher is linear in its tokens, so the four fields' blocks add up to the hashed row
+        features = (
+            TEXT_HASHER.transform(titles)[codes["title"]],
+            TEXT_HASHER.transform(tags)[codes["tags"]],
+            sum(
+                CATEGORY_HASHER.transform([[f"{prefix}={value}"] for value in values[field]])[codes[field]]
+                for field, prefix in CATEGORICAL_FIELDS
+            ),
+        )
+    else:
+        features = (
+            feature_space["title_vectorizer"].transform(titles)[codes["title"]],
+            feature_space["tag_vectorizer"].transform(tags)[codes["tags"]],
+            *[
+                sparse.csr_matrix(encode_labels(encoder, values[field])[codes[field]].reshape(-1, 1).astype(np.float64))
+                for encoder, (field, _) in zip(feature_space["label_encoders"], CATEGORICAL_FIELDS)
+            ],
+        )
+
+    # Keep every feature sparse: a dense TF-IDF matrix needs gigabytes per 100k rows,
+    # while ~15 non-zeros per alert keep the peak near 200 MB per 100k rows up to the SVD
+    combined_data = sparse.hstack(features, format="csr")
+
+    with metrics.stage("svd"):
+        if "svd" not in feature_space:
+            # Ensure n_components is within the valid range
+            n_samples, n_features = combined_data.shape
+            n_components = max(1, min(50, n_samples - 1, n_features - 1))
+
+            # Reduce dimensionality with randomized truncated SVD, which works on sparse input directly.
+            # Rows scaled by the square root of their weight have the Gram matrix of the repeated rows
+            fit_data = combined_data if sample_weight is None else sparse.diags(np.sqrt(sample_weight)) @ combined_data
+            feature_space["svd"] = TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=0).fit(fit_data)
+        reduced_data = feature_space["svd"].transform(combined_data)
+
+    return reduced_data, feature_space
 
-def ensure_column_exists():
-    """Ensure the dbscan_cluster column exists in the sigma_alerts table."""
+def read_tuned_params():
+    """Read the DBSCAN parameters chosen by the last search, if any."""
+    if not os.path.exists(tuned_params_file):
+        return None
     try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
-            cursor.execute("SHOW COLUMNS FROM sigma_alerts LIKE 'dbscan_cluster'")
-            result = cursor.fetchone()
-            if not result:
-                cursor.execute("ALTER TABLE sigma_alerts ADD COLUMN dbscan_cluster INT")
-                connection.commit()
-                logging.info("Added 'dbscan_cluster' column to 'sigma_alerts' table.")
-    except Error as e:
-        logging.error(f"Error ensuring 'dbscan_cluster' column exists: {e}")
-    finally:
-        if connection.is_connected():
-            connection.close()
-
-def preprocess_data(data):
-    """Preprocess the data for DBSCAN."""
-    titles = [row[1] for row in data]
-    tags = [row[2] for row in data]
-    computer_names = [row[3] for row in data]
-    user_ids = [row[4] for row in data]
-    event_ids = [row[5] for row in data]
-    provider_names = [row[6] for row in data]
-
-    tfidf_vectorizer = TfidfVectorizer(stop_words="english")
-    title_tfidf = tfidf_vectorizer.fit_transform(titles)
-    tag_tfidf = tfidf_vectorizer.fit_transform(tags)
-
-    label_encoder = LabelEncoder()
-    computer_name_encoded = label_encoder.fit_transform(computer_names)
-    user_id_encoded = label_encoder.fit_transform(user_ids)
-    event_id_encoded = label_encoder.fit_transform(event_ids)
-    provider_name_encoded = label_encoder.fit_transform(provider_names)
-
-    combined_data = np.hstack((
-        title_tfidf.toarray(),
-        tag_tfidf.toarray(),
-        computer_name_encoded.reshape(-1, 1),
-        user_id_encoded.reshape(-1, 1),
-        event_id_encoded.reshape(-1, 1),
-        provider_name_encoded.reshape(-1, 1)
-    ))
-
-    # Ensure n_components is within the valid range
-    n_samples, n_features = combined_data.shape
-    n_components = min(50, n_samples, n_features)
-
-    # Reduce dimensionality using PCA
-    pca = PCA(n_components=n_components)  # Adjust n_components based on dataset size and variance explained
-    reduced_data = pca.fit_transform(combined_data)
-
-    return reduced_data
-
-def run_dbscan(data):
-    """Run DBSCAN clustering on the provided data and return the cluster labels."""
+        with open(tuned_params_file, "r") as file:
+            params = json.load(file)
+        return float(params["eps"]), int(params["min_samples"])
+    except (ValueError, KeyError, OSError) as e:
+        logging.error(f"Invalid tuned parameters file {tuned_params_file}: {e}")
+        return None
+
+def write_tuned_params(eps, min_samples, score):
+    """Atomically store the chosen DBSCAN parameters for the next search."""
+    write_atomic(tuned_params_file, json.dumps({"eps": eps, "min_samples": min_samples, "silhouette_score": score}))
+
+def candidate_grid(tuned_params):
+    """Return the eps values and min_samples values to search, narrowed around tuned parameters."""
+    if tuned_params is None:
+        return EPS_CANDIDATES, MIN_SAMPLES_CANDIDATES
+    tuned_eps, tuned_min_samples = tuned_params
+    eps_values = [eps for eps in EPS_CANDIDATES if abs(eps - tuned_eps) <= 0.11]
+    min_samples_values = [m for m in MIN_SAMPLES_CANDIDATES if abs(m - tuned_min_samples) <= 1]
+    return eps_values or EPS_CANDIDATES, min_samples_values or MIN_SAMPLES_CANDIDATES
+
+def init_search_worker(graph, data_scaled, sample_weight, silhouette_rows, blas_threads):
+    """Hand the neighbour graph, scaled data, weights and silhouette sample to a search worker process once, capping its BLAS threads."""
+    search_state["limits"] = threadpool_limits(limits=blas_threads)
+    search_state["graph"] = graph
+    search_state["data_scaled"] = data_scaled
+    search_state["sample_weight"] = sample_weight
+    search_state["silhouette_rows"] = silhouette_rows
+
+def silhouette_sample(sample_weight):
+    """Rows of deduplicated data to score the silhouette on, drawn in proportion to their weight.
+
+    A row can be drawn more than once, as its duplicates could have been
+    before deduplication. Below SILHOUETTE_SAMPLE_SIZE alerts every row is
+    repeated by its weight, which scores the full data.
+    """
+    total = int(sample_weight.sum())
+    if total <= SILHOUETTE_SAMPLE_SIZE:
+        return np.repeat(np.arange(len(sample_weight)), sample_weight.astype(int))
+    rng = np.random.default_rng(0)
+    return rng.choice(len(sample_weight), size=SILHOUETTE_SAMPLE_SIZE, p=sample_weight / sample_weight.sum())
+
+def score_eps_in_worker(eps, min_samples_values):
+    """score_eps on the neighbour graph and data handed to this search worker process."""
+    return score_eps(
+        eps, min_samples_values, search_state["graph"], search_state["data_scaled"],
+        search_state["sample_weight"], search_state["silhouette_rows"],
+    )
+
+def score_eps(eps, min_samples_values, graph, data_scaled, sample_weight, silhouette_rows):
+    """Fit DBSCAN on the neighbour graph for one eps and return the best candidate.
+
+    min_samples values are tried in increasing order. Core points only get
+    fewer as min_samples grows, so the loop stops once every point is noise,
+    and after SEARCH_PATIENCE candidates in a row that do not beat the best
+    score. Returns (score, eps, min_samples, labels, core_sample_indices) or
+    None when no min_samples value gives more than one cluster.
+    """
+    n_samples = data_scaled.shape[0]
+    sample_size = SILHOUETTE_SAMPLE_SIZE if n_samples > SILHOUETTE_SAMPLE_SIZE else None
+
+    best = None
+    stale = 0
+    for min_samples in sorted(min_samples_values):
+        db = DBSCAN(eps=eps, min_samples=min_samples, metric="precomputed").fit(graph, sample_weight=sample_weight)
+        if not len(db.core_sample_indices_):
+            break  # All noise, and so is every larger min_samples
+        if len(set(db.labels_)) > 1:  # Ensure we have more than one cluster
+            try:
+                if silhouette_rows is None:
+                    score = silhouette_score(data_scaled, db.labels_, sample_size=sample_size, random_state=0)
+                else:
+                    score = silhouette_score(data_scaled[silhouette_rows], db.labels_[silhouette_rows])
+            except ValueError:
+                continue  # The sample held a single label
+            if best is None or score > best[0]:
+                best = (score, eps, min_samples, db.labels_, db.core_sample_indices_)
+                stale = 0
+            else:
+                stale += 1
+                if SEARCH_PATIENCE and stale >= SEARCH_PATIENCE:
+                    break
+    return best
+
+def search_dbscan_params(data_scaled, workers, sample_weight=None, tuned_params=None):
+    """Search eps and min_samples on one neighbour graph and return the best candidate.
+
+    With tuned_params, (eps, min_samples) of an earlier search, only the
+    neighbouring grid values are tried. With sample_weight each row counts
+    as that many points towards min_samples, and the silhouette is scored on
+    a weighted sample.
+    """
+    eps_values, min_samples_values = candidate_grid(tuned_params)
+
+    # Every candidate eps is a sub-radius of the largest one, so a single
+    # radius graph holds the neighbourhoods of the whole grid. Each point is
+    # kept as its own zero-distance neighbour, which DBSCAN counts towards
+    # min_samples.
+    graph = neighbor_index.radius_graph(data_scaled, max(EPS_CANDIDATES))
+    silhouette_rows = silhouette_sample(sample_weight) if sample_weight is not None else None
+
+    # Worker processes times their BLAS threads stay within the CPU count
+    cpu_count = os.cpu_count() or 1
+    workers = min(workers, cpu_count, len(eps_values))
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_search_worker,
+            initargs=(graph, data_scaled, sample_weight, silhouette_rows, max(1, cpu_count // workers)),
+        ) as executor:
+            results = list(executor.map(score_eps_in_worker, eps_values, [min_samples_values] * len(eps_values)))
+    else:
+        # In-process, possibly on several batch threads at once, so nothing goes through search_state
+        results = [score_eps(eps, min_samples_values, graph, data_scaled, sample_weight, silhouette_rows) for eps in eps_values]
+
+    results = [result for result in results if result is not None]
+    if not results and tuned_params is not None:
+        logging.info("Warm-started DBSCAN search found no clustering, searching the full grid.")
+        return search_dbscan_params(data_scaled, workers, sample_weight)
+    if not results:
+        # Fall back to the DBSCAN defaults
+        db = DBSCAN(eps=0.5, min_samples=5, metric="precomputed").fit(graph, sample_weight=sample_weight)
+        return (-1, 0.5, 5, db.labels_, db.core_sample_indices_)
+    return max(results, key=lambda result: result[0])
+
+def run_dbscan(data, search_workers=SEARCH_WORKERS, sample_weight=None, tuned_params=None):
+    """Run DBSCAN clustering on the provided data and return the cluster labels and core-point model.
+
+    sample_weight is the number of alerts each row of deduplicated data
+    stands for; tuned_params warm-starts the search. The core-point model
+    also records the chosen min_samples and silhouette score.
+    """
     scaler = StandardScaler()
-    data_scaled = scaler.fit_transform(data)
-    
-    # Tune DBSCAN parameters
-    best_score = -1
-    best_eps = 0.5
-    best_min_samples = 5
-    for eps in np.arange(0.1, 1.0, 0.1):
-        for min_samples in range(2, 10):
-            db = DBSCAN(eps=eps, min_samples=min_samples).fit(data_scaled)
-            if len(set(db.labels_)) > 1:  # Ensure we have more than one cluster
-                score = silhouette_score(data_scaled, db.labels_)
-                if score > best_score:
-                    best_score = score
-                    best_eps = eps
-                    best_min_samples = min_samples
+    data_scaled = scaler.fit(data, sample_weight=sample_weight).transform(data)
 
+    # Tune DBSCAN parameters and keep the labels of the winning candidate
+    with metrics.stage("grid_search"):
+        best_score, best_eps, best_min_samples, labels, core_sample_indices = search_dbscan_params(data_scaled, search_workers, sample_weight, tuned_params)
     logging.info(f"Best DBSCAN parameters: eps={best_eps}, min_samples={best_min_samples}, silhouette_score={best_score}")
-    
-    db = DBSCAN(eps=best_eps, min_samples=best_min_samples).fit(data_scaled)
-    return db.labels_
+    metrics.set_gauge("dbscan_eps", best_eps)
+    metrics.set_gauge("dbscan_min_samples", best_min_samples)
+    metrics.set_gauge("dbscan_silhouette_score", float(best_score))
+
+    core_model = build_core_model(scaler, data_scaled, labels, core_sample_indices, best_eps)
+    core_model["min_samples"] = best_min_samples
+    core_model["silhouette_score"] = float(best_score)
+    return labels, core_model
 
+def build_core_model(scaler, data_scaled, labels, core_sample_indices, eps):
+    """Keep what is needed to assign new points to the clusters found by a DBSCAN fit."""
+    core_points = data_scaled[core_sample_indices]
+    index = NearestNeighbors(n_neighbors=1).fit(core_points) if len(core_points) else None
+    return {
+        "scaler": scaler,
+        "eps": eps,
+        "core_points": core_points,
+        "core_labels": labels[core_sample_indices],
+        "index": index,
+    }
+
+def assign_to_clusters(data, core_models):
+    """Assign reduced points to the cluster of the nearest core point within eps, or -1 for noise."""
+    labels = np.full(len(data), -1, dtype=int)
+    best_ratio = np.full(len(data), np.inf)
+    for model in core_models:
+        if model["index"] is None:
+            continue
+        distances, indices = model["index"].kneighbors(model["scaler"].transform(data))
+        # Compare models on distance relative to their own eps
+        ratio = distances[:, 0] / model["eps"]
+        hit = (ratio <= 1.0) & (ratio < best_ratio)
+        labels[hit] = model["core_labels"][indices[hit, 0]]
+        best_ratio[hit] = ratio[hit]
+    return labels
+
+@metrics.timed("write_back")
 def update_cluster_labels(data, cluster_labels):
-    """Update the sigma_alerts table with the cluster labels."""
+    """Update the sigma_alerts table with the cluster labels.
+
+    Labels are bulk-loaded into a session staging table and applied with one
+    joined UPDATE per chunk that only touches rows whose label changed. Each
+    chunk is committed on its own to keep row locks short next to ingest.
+    Rows that became anomalies lower logger.py's export watermark below
+    them. When any label changed, an alerts_clustered event is published.
+    """
+    ids = as_columns(data).ids
+    cluster_labels = np.asarray(cluster_labels)
     try:
-        connection = mysql.connector.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS dbscan_cluster_staging (
+                id INT PRIMARY KEY,
+                dbscan_cluster INT
+            ) ENGINE=MEMORY
+            """)
+            insert_query = "INSERT INTO dbscan_cluster_staging (id, dbscan_cluster) VALUES (%s, %s)"
             update_query = """
-            UPDATE sigma_alerts
-            SET dbscan_cluster = %s
-            WHERE id = %s
+            UPDATE sigma_alerts AS alerts
+            JOIN dbscan_cluster_staging AS staging ON alerts.id = staging.id
+            SET alerts.dbscan_cluster = staging.dbscan_cluster
+            WHERE NOT (alerts.dbscan_cluster <=> staging.dbscan_cluster)
             """
-            update_data = [(int(cluster_labels[i]), data[i][0]) for i in range(len(data))]
-            cursor.executemany(update_query, update_data)
-            connection.commit()
-            logging.info(f"Updated {len(update_data)} records with cluster labels.")
+            new_anomaly_query = """
+            SELECT MIN(alerts.id) FROM sigma_alerts AS alerts
+            JOIN dbscan_cluster_staging AS staging ON alerts.id = staging.id
+            WHERE staging.dbscan_cluster = -1 AND NOT (alerts.dbscan_cluster <=> -1)
+            """
+
+            updated = 0
+            lowest_new_anomaly = None
+            for i in range(0, len(ids), WRITE_BACK_CHUNK_SIZE):
+                chunk = list(zip(ids[i:i + WRITE_BACK_CHUNK_SIZE].tolist(), cluster_labels[i:i + WRITE_BACK_CHUNK_SIZE].tolist()))
+                cursor.execute("DELETE FROM dbscan_cluster_staging")
+                cursor.executemany(insert_query, chunk)
+                cursor.execute(new_anomaly_query)
+                lowest = cursor.fetchone()[0]
+                if lowest is not None and (lowest_new_anomaly is None or lowest < lowest_new_anomaly):
+                    lowest_new_anomaly = lowest
+                cursor.execute(update_query)
+                updated += cursor.rowcount
+                connection.commit()
+
+            if lowest_new_anomaly is not None:
+                # After the labels are committed, so an export pass that missed them cannot advance past them
+                cursor.execute(
+                    "UPDATE export_state SET exported_through = LEAST(exported_through, %s), generation = generation + 1",
+                    (lowest_new_anomaly - 1,),
+                )
+                connection.commit()
+
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS dbscan_cluster_staging")
+            logging.info(f"Updated {updated} of {len(ids)} records with changed cluster labels.")
+            metrics.inc("labels_changed_total", updated)
+
+        # Tell logger.py that labels changed, so new anomalies are exported right away
+        if updated:
+            publish(ALERTS_CLUSTERED, rows=updated, anomalies=int(np.sum(cluster_labels == -1)), max_id=int(ids.max()))
     except Error as e:
         logging.error(f"Error updating cluster labels: {e}")
-    finally:
-        if connection.is_connected():
-            connection.close()
+
+def restore_clustering_state():
+    """Load the persisted feature space and clusters, so a restart continues incrementally."""
+    restored = artifacts.load_clustering_state(ENCODER_SETTINGS)
+    if restored:
+        clustering_state.update(restored)
+
+def unseen_rows(data, feature_space):
+    """Count the rows with a categorical value the fitted encoders have not seen; hashed encoders see every value."""
+    if feature_space["encoder"] == "hashing":
+        return 0
+    data = as_columns(data)
+    unseen = np.zeros(len(data), dtype=bool)
+    for encoder, (field, _) in zip(feature_space["label_encoders"], CATEGORICAL_FIELDS):
+        unseen |= (encode_labels(encoder, data.values[field]) == len(encoder.classes_))[data.codes[field]]
+    return int(np.sum(unseen))
+
+def full_refit_due():
+    """Check whether the next run has to re-fit the feature space and clusters."""
+    if not INCREMENTAL_CLUSTERING or clustering_state["feature_space"] is None:
+        return True
+    drift_rows = clustering_state["drift_rows"]
+    if drift_rows >= DRIFT_MIN_ROWS and clustering_state["drift_unseen"] / drift_rows > DRIFT_THRESHOLD:
+        logging.info(f"{clustering_state['drift_unseen']} of {drift_rows} alerts since the last fit are outside the feature space, re-fitting.")
+        return True
+    elapsed = datetime.now() - clustering_state["last_full_fit"]
+    return elapsed.total_seconds() >= FULL_REFIT_MINUTES * 60
 
 def detect_anomalies():
     """Fetch data, run DBSCAN, and update the database with cluster labels."""
-    ensure_column_exists()
+    if full_refit_due():
+        with metrics.stage("cluster_all"):
+            cluster_all_alerts()
+    else:
+        with metrics.stage("cluster_new"):
+            cluster_new_alerts()
 
+def cluster_all_alerts():
+    """Re-fit the feature space and clusters on the whole sigma_alerts table."""
     data = fetch_data()
     if not data:
         logging.warning("No data found in the database.")
         return
 
-    preprocessed_data = preprocess_data(data)
+    # Cluster each distinct feature row once, weighted by its number of alerts
+    unique_data, inverse, counts = deduplicate(data)
+    preprocessed_data, feature_space = preprocess_data(unique_data, sample_weight=counts)
     start_time = datetime.now()
 
     # Split data into batches to avoid memory issues
     batch_size = determine_batch_size(len(preprocessed_data))
-    cluster_labels = np.array([])
+    cluster_labels = np.full(len(preprocessed_data), -1, dtype=int)
+    batch_results = []
 
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = []
-        for i in range(0, len(preprocessed_data), batch_size):
-            batch_data = preprocessed_data[i:i + batch_size]
-            futures.append(executor.submit(run_dbscan, batch_data))
+    # Batches complete in any order, each one owns its slice of the labels
+    for start, stop, batch_labels, core_model in cluster_batches(preprocessed_data, batch_size, counts, read_tuned_params()):
+        cluster_labels[start:stop] = batch_labels
+        batch_results.append((start, stop, core_model))
 
-        for future in as_completed(futures):
-            batch_labels = future.result()
-            cluster_labels = np.concatenate((cluster_labels, batch_labels))
+    # The best-scoring batch warm-starts the next run's searches
+    best_batch = max((core_model for _, _, core_model in batch_results), key=lambda core_model: core_model["silhouette_score"])
+    write_tuned_params(best_batch["eps"], best_batch["min_samples"], best_batch["silhouette_score"])
+
+    cluster_labels, core_models = reconcile_batch_clusters(cluster_labels, batch_results)
+    # Every alert takes the label of its distinct row
+    cluster_labels = cluster_labels[inverse]
 
     end_time = datetime.now()
     duration = end_time - start_time
     logging.info(f"DBSCAN clustering completed in {duration.total_seconds()} seconds.")
+    record_anomalies(cluster_labels, "full")
 
     update_cluster_labels(data, cluster_labels)
 
+    clustering_state["feature_space"] = feature_space
+    clustering_state["core_models"] = core_models
+    clustering_state["high_water_mark"] = data.max_id
+    clustering_state["last_full_fit"] = end_time
+    clustering_state["drift_rows"] = 0
+    clustering_state["drift_unseen"] = 0
+    try:
+        artifacts.save_clustering_state(clustering_state)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error saving feature space artifacts: {e}")
+
+def init_batch_worker(matrix_path, blas_threads):
+    """Map the shared feature matrix and cap BLAS threads in a batch worker process."""
+    batch_worker_state["data"] = np.load(matrix_path, mmap_mode="r")
+    batch_worker_state["limits"] = threadpool_limits(limits=blas_threads)
+
+def run_dbscan_on_slice(start, stop, sample_weight, tuned_params):
+    """Cluster rows start:stop of the memory-mapped feature matrix; the worker's metrics go back with the result."""
+    batch_labels, core_model = run_dbscan(np.asarray(batch_worker_state["data"][start:stop]), search_workers=1, sample_weight=sample_weight, tuned_params=tuned_params)
+    return start, stop, batch_labels, core_model, metrics.drain()
+
+def cluster_batches(preprocessed_data, batch_size, sample_weight=None, tuned_params=None):
+    """Run DBSCAN on each batch with the configured executor backend, every search warm-started from tuned_params.
+
+    Yields (start, stop, labels, core_model) per batch as batches complete.
+    The process backend writes the feature matrix to a memory-mapped file once
+    and workers read their slice from it, so batches are never pickled. Batch
+    workers search serially with their share of the CPUs as BLAS threads; the
+    serial backend gives each search up to SEARCH_WORKERS processes, capped
+    the same way.
+    """
+    bounds = [(i, min(i + batch_size, len(preprocessed_data))) for i in range(0, len(preprocessed_data), batch_size)]
+    weights = [None if sample_weight is None else sample_weight[start:stop] for start, stop in bounds]
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(CLUSTER_WORKERS, cpu_count, len(bounds)))
+    blas_threads = max(1, cpu_count // workers)
+
+    if CLUSTER_EXECUTOR == "serial" or workers == 1:
+        for (start, stop), batch_weight in zip(bounds, weights):
+            yield (start, stop, *run_dbscan(preprocessed_data[start:stop], sample_weight=batch_weight, tuned_params=tuned_params))
+
+    elif CLUSTER_EXECUTOR == "thread":
+        # The BLAS limit applies to the whole process: each thread's BLAS calls
+        # use at most its share of the CPUs, and each thread searches serially
+        with threadpool_limits(limits=blas_threads), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_dbscan, preprocessed_data[start:stop], 1, batch_weight, tuned_params): (start, stop)
+                for (start, stop), batch_weight in zip(bounds, weights)
+            }
+            for future in as_completed(futures):
+                yield (*futures[future], *future.result())
+
+    elif CLUSTER_EXECUTOR == "process":
+        # Prefer tmpfs so the mapped matrix never touches disk
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        with tempfile.NamedTemporaryFile(suffix=".npy", dir=shm_dir) as matrix_file:
+            np.save(matrix_file, np.ascontiguousarray(preprocessed_data))
+            matrix_file.flush()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_batch_worker,
+                initargs=(matrix_file.name, blas_threads),
+            ) as executor:
+                futures = [
+                    executor.submit(run_dbscan_on_slice, start, stop, batch_weight, tuned_params)
+                    for (start, stop), batch_weight in zip(bounds, weights)
+                ]
+                for future in as_completed(futures):
+                    start, stop, batch_labels, core_model, worker_metrics = future.result()
+                    metrics.merge(worker_metrics)
+                    yield start, stop, batch_labels, core_model
+
+    else:
+        raise ValueError(f"Unknown DBSCAN_EXECUTOR '{CLUSTER_EXECUTOR}', expected process, thread or serial.")
+
+def reconcile_batch_clusters(cluster_labels, batch_results):
+    """Turn per-batch cluster ids into globally consistent ones.
+
+    Batch-local ids are first offset so they are unique across batches. Two
+    clusters from different batches are then merged when a core point of one
+    lies within eps of a core point of the other, which is the same density
+    connection DBSCAN would have found had both batches been clustered
+    together. Returns the relabelled array and the core models with global ids.
+    """
+    batch_results = sorted(batch_results, key=lambda result: result[0])
+    cluster_labels = cluster_labels.copy()
+    core_models = []
+    next_id = 0
+    for start, stop, core_model in batch_results:
+        batch_labels = cluster_labels[start:stop]
+        clustered = batch_labels >= 0
+        batch_clusters = int(batch_labels.max()) + 1 if clustered.any() else 0
+        batch_labels[clustered] += next_id
+        core_models.append({**core_model, "core_labels": core_model["core_labels"] + next_id})
+        next_id += batch_clusters
+
+    if next_id == 0:
+        return cluster_labels, core_models
+
+    # Link clusters whose core points fall within eps of another batch's core points
+    edges_from, edges_to = [], []
+    for model in core_models:
+        if model["index"] is None:
+            continue
+        for other in core_models:
+            if other is model or not len(other["core_points"]):
+                continue
+            other_points = model["scaler"].transform(other["scaler"].inverse_transform(other["core_points"]))
+            distances, indices = model["index"].kneighbors(other_points)
+            linked = distances[:, 0] <= model["eps"]
+            edges_from.append(other["core_labels"][linked])
+            edges_to.append(model["core_labels"][indices[linked, 0]])
+
+    edges_from = np.concatenate(edges_from) if edges_from else np.array([], dtype=int)
+    edges_to = np.concatenate(edges_to) if edges_to else np.array([], dtype=int)
+    links = sparse.coo_matrix((np.ones(len(edges_from)), (edges_from, edges_to)), shape=(next_id, next_id))
+    n_clusters, global_ids = connected_components(links, directed=False)
+    logging.info(f"Reconciled {next_id} batch clusters into {n_clusters} global clusters.")
+
+    clustered = cluster_labels >= 0
+    cluster_labels[clustered] = global_ids[cluster_labels[clustered]]
+    for model in core_models:
+        model["core_labels"] = global_ids[model["core_labels"]]
+    return cluster_labels, core_models
+
+def cluster_new_alerts():
+    """Assign alerts that have no cluster label yet to the existing clusters."""
+    data = fetch_data(unlabelled=True)
+    if not data:
+        logging.info("No unlabelled alerts.")
+        return
+
+    assign_new_alerts(data)
+
+def assign_new_alerts(data):
+    """Assign fetched alerts, as AlertColumns or row tuples, to the existing clusters, store their labels and return them."""
+    data = as_columns(data)
+    start_time = datetime.now()
+    unique_data, inverse, _ = deduplicate(data)
+    preprocessed_data, _ = preprocess_data(unique_data, clustering_state["feature_space"])
+    cluster_labels = assign_to_clusters(preprocessed_data, clustering_state["core_models"])[inverse]
+    duration = datetime.now() - start_time
+    logging.info(
+        f"Assigned {len(data)} new alerts in {duration.total_seconds()} seconds, "
+        f"{int(np.sum(cluster_labels == -1))} marked as noise."
+    )
+    record_anomalies(cluster_labels, "incremental")
+
+    update_cluster_labels(data, cluster_labels)
+    clustering_state["high_water_mark"] = max(clustering_state["high_water_mark"], data.max_id)
+    clustering_state["drift_rows"] += len(data)
+    clustering_state["drift_unseen"] += unseen_rows(data, clustering_state["feature_space"])
+    if clustering_state["artifact_version"]:
+        try:
+            artifacts.save_progress(clustering_state)
+        except OSError as e:
+            logging.error(f"Error saving clustering progress: {e}")
+    return cluster_labels
+
+def fetch_latest_id():
+    """Return the highest id in sigma_alerts, or 0 when it is empty."""
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT MAX(id) FROM sigma_alerts")
+            return cursor.fetchone()[0] or 0
+    except Error as e:
+        logging.error(f"Error fetching the latest alert id: {e}")
+        return 0
+
+def start_streaming():
+    """Fit the feature space on the latest alerts and seed the micro-clusters with them.
+
+    Only the last STREAM_BOOTSTRAP_ROWS ids are read, so start-up and memory
+    do not grow with the table. Older unlabelled alerts are left alone.
+    """
+    latest_id = fetch_latest_id()
+    stream_state["low_water_mark"] = max(0, latest_id - STREAM_BOOTSTRAP_ROWS)
+    data = fetch_data(min_id=stream_state["low_water_mark"])
+    if not data:
+        logging.warning("No data found in the database, streaming starts with an empty model.")
+        return
+
+    preprocessed_data, feature_space = preprocess_data(data)
+    scaler = StandardScaler()
+    data_scaled = scaler.fit_transform(preprocessed_data)
+    model = MicroClusterModel(data_scaled.shape[1])
+    model.absorb_all(data_scaled)
+    model.recluster()
+
+    stream_state.update(feature_space=feature_space, scaler=scaler, model=model, last_recluster=time.monotonic())
+    update_cluster_labels(data, model.predict(data_scaled))
+    logging.info(f"Seeded {model.count} micro-clusters from {len(data)} recent alerts.")
+
+def stream_new_alerts():
+    """Absorb the unlabelled alerts since the bootstrap and store their labels, reclustering when due."""
+    if stream_state["model"] is None:
+        start_streaming()
+        return
+    model = stream_state["model"]
+    data = fetch_data(min_id=stream_state["low_water_mark"], unlabelled=True)
+    if data:
+        start_time = datetime.now()
+        preprocessed_data, _ = preprocess_data(data, stream_state["feature_space"])
+        cluster_labels = model.absorb_all(stream_state["scaler"].transform(preprocessed_data))
+        duration = datetime.now() - start_time
+        logging.info(
+            f"Absorbed {len(data)} new alerts into {model.count} micro-clusters in {duration.total_seconds()} seconds, "
+            f"{int(np.sum(cluster_labels == -1))} marked as outliers."
+        )
+        record_anomalies(cluster_labels, "stream")
+        metrics.set_gauge("micro_clusters", model.count)
+        update_cluster_labels(data, cluster_labels)
+
+    if time.monotonic() - stream_state["last_recluster"] >= STREAM_RECLUSTER_SECONDS:
+        with metrics.stage("recluster"):
+            model.recluster()
+        stream_state["last_recluster"] = time.monotonic()
+
+def deduplicate(data):
+    """Group alerts that are identical on every feature column and report the share of repeats.
+
+    Returns the distinct rows, the distinct row of every alert and the
+    number of alerts per distinct row.
+    """
+    unique_data, inverse, counts = data.unique_rows()
+    ratio = 1 - len(unique_data) / len(data) if len(data) else 0.0
+    logging.info(f"Deduplicated {len(data)} alerts into {len(unique_data)} distinct feature rows ({ratio:.1%} repeats).")
+    metrics.set_gauge("dedup_ratio", ratio)
+    metrics.inc("alerts_deduplicated_total", len(data) - len(unique_data))
+    return unique_data, inverse, counts
+
+def record_anomalies(cluster_labels, run):
+    """Count the alerts labelled by a run and the anomalies (noise) among them."""
+    anomalies = int(np.sum(cluster_labels == -1))
+    metrics.inc("alerts_labelled_total", len(cluster_labels), run=run)
+    metrics.inc("anomalies_total", anomalies, run=run)
+    metrics.set_gauge("last_run_anomalies", anomalies, run=run)
+
 def determine_batch_size(total_samples):
     """Determine the appropriate batch size based on system memory and total samples."""
     mem = psutil.virtual_memory()
     available_memory = mem.available / (1024 ** 2)  # Convert to MB
     logging.info(f"Available memory: {available_memory} MB")
+    metrics.set_gauge("available_memory_bytes", mem.available)
 
     # Estimate batch size based on available memory (this is a heuristic)
     batch_size = min(max(1000, int(available_memory / 10)), total_samples)
     logging.info(f"Determined batch size: {batch_size}")
     return batch_size
 
-# Run the script immediately with existing data
-detect_anomalies()
+if __name__ == "__main__":
+    apply_migrations()
+    metrics.start()
+
+    if CLUSTERING_MODE == "stream":
+        # Absorb new alerts as soon as SQL.py reports them, and every few seconds otherwise
+        start_streaming()
+        listener = EventListener(ALERTS_INGESTED)
+        while True:
+            listener.wait(timeout=STREAM_POLL_SECONDS)
+            with metrics.stage("stream"):
+                stream_new_alerts()
+
+    restore_clustering_state()
+
+    # Run the script immediately with existing data
+    detect_anomalies()
 
-# Schedule anomaly detection every 5 minutes
-schedule.every(5).minutes.do(detect_anomalies)
+    # Cluster as soon as SQL.py reports new alerts; the 5 minute schedule is a
+    # fallback for missed events
+    listener = EventListener(ALERTS_INGESTED)
+    schedule.every(5).minutes.do(detect_anomalies)
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+    while True:
+        schedule.run_pending()
+        event = listener.wait(timeout=1)
+        if event:
+            logging.info(f"{event['rows']} new alerts up to id {event['max_id']} reported in {event['events']} events.")
+            detect_anomalies()
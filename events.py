@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import socket
+import select
+import logging
+
+logger = logging.getLogger()
+
+# Directory of the Unix datagram sockets, one per channel
+EVENT_SOCKET_DIR = os.getenv("EVENT_SOCKET_DIR", "/run/anomalyhunter")
+
+# Channels: SQL.py publishes ingested rows for dbscan.py, dbscan.py publishes clustered rows for logger.py
+ALERTS_INGESTED = "alerts_ingested"
+ALERTS_CLUSTERED = "alerts_clustered"
+
+# Quiet period that ends a burst of events, and the longest a burst may hold back a run
+EVENT_DEBOUNCE_SECONDS = float(os.getenv("EVENT_DEBOUNCE_SECONDS", "2"))
+EVENT_MAX_DELAY_SECONDS = float(os.getenv("EVENT_MAX_DELAY_SECONDS", "10"))
+
+MAX_DATAGRAM = 64 * 1024
+
+def socket_path(channel):
+    return os.path.join(EVENT_SOCKET_DIR, f"{channel}.sock")
+
+def publish(channel, **payload):
+    """Send an event to the channel's listener without blocking.
+
+    Events are hints: when no listener is bound, or its buffer is full
+    because it is busy with a run, the event is dropped. The listener
+    then either still has events pending or catches up on its fallback
+    timer, and the database stays the source of truth.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        try:
+            sender.sendto(json.dumps(payload).encode(), socket_path(channel))
+            return True
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            return False
+        except OSError as e:
+            logger.error(f"Error publishing {channel} event: {e}")
+            return False
+
+def coalesce(events):
+    """Merge a burst of events: rows are summed, the highest id wins."""
+    merged = {"events": len(events), "rows": 0, "max_id": 0}
+    for event in events:
+        merged["rows"] += event.get("rows", 0)
+        merged["max_id"] = max(merged["max_id"], event.get("max_id") or 0)
+    return merged
+
+class EventListener:
+    """Receive a channel's events on a Unix datagram socket, debounced and coalesced.
+
+    wait() returns None when nothing arrived within the timeout. Otherwise it
+    keeps reading until the channel has been quiet for debounce_seconds, or
+    max_delay_seconds have passed since the first event, and returns the
+    burst merged into one event. Events sent while the caller is busy queue
+    up in the socket buffer and are merged into the next wait().
+    """
+
+    def __init__(self, channel, debounce_seconds=EVENT_DEBOUNCE_SECONDS, max_delay_seconds=EVENT_MAX_DELAY_SECONDS):
+        self.channel = channel
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.path = socket_path(channel)
+        os.makedirs(EVENT_SOCKET_DIR, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left behind by a previous run
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        logger.info(f"Listening for {channel} events on {self.path}.")
+
+    def receive(self, timeout):
+        """Read the datagrams that arrive within timeout seconds."""
+        events = []
+        readable, _, _ = select.select([self.sock], [], [], max(0, timeout))
+        if not readable:
+            return events
+        while True:
+            try:
+                datagram = self.sock.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                return events
+            try:
+                events.append(json.loads(datagram))
+            except ValueError:
+                logger.error(f"Ignoring malformed {self.channel} event.")
+
+    def wait(self, timeout):
+        events = self.receive(timeout)
+        if not events:
+            return None
+        deadline = time.monotonic() + self.max_delay_seconds
+        while time.monotonic() < deadline:
+            more = self.receive(min(self.debounce_seconds, deadline - time.monotonic()))
+            if not more:
+                break
+            events.extend(more)
+        return coalesce(events)
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,11 +1,15 @@
 import os
 import logging
 import schedule
-import time  # Import the time module
-import mysql.connector
 from datetime import datetime
 from mysql.connector import Error
-from mysql.connector.pooling import MySQLConnectionPool
+import db
+import metrics
+import raw_store
+from cef_writer import CefWriter, format_cef_event
+from syslog_forwarder import SyslogForwarder, SYSLOG_FORWARD_HOST, SYSLOG_FORWARD_PORT, SYSLOG_FORWARD_PROTOCOL
+from events import ALERTS_CLUSTERED, EventListener
+from migrations import apply_migrations
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -15,39 +19,106 @@ logger = logging.getLogger()
 cef_file_path = "/var/log/anomalyhunter/anomaly.syslog"
 log_dir = "/var/log/anomalyhunter"
 
-# Database configuration
-db_config = {
-    "host": "localhost",
-    "user": "sigma",
-    "password": "sigma",
-    "database": "sigma_db",
-    "pool_name": "mypool",
-    "pool_size": 5
-}
+# Batched, rotating CEF writer; can be turned off when events are forwarded directly
+CEF_FILE_OUTPUT = os.getenv("CEF_FILE_OUTPUT", "true").lower() == "true"
+cef_log = CefWriter(cef_file_path)
 
-# Create a connection pool
-connection_pool = MySQLConnectionPool(**db_config)
+# Optional direct syslog forwarding, started in main when SYSLOG_FORWARD_HOST is set
+syslog_forwarder = None
+
+# Column of the raw hash in fetched anomaly rows, replaced by the raw line when it is exported
+RAW_COLUMN = 10
+
+# Anomalies fetched and exported per keyset page
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
 
 # Helper functions
-def fetch_anomalies():
-    """Fetch anomalies (cluster -1) from the sigma_alerts table."""
+@metrics.timed("fetch_anomalies")
+def fetch_anomalies(after_id, limit=EXPORT_BATCH_SIZE):
+    """Fetch the next page of not yet exported anomalies (cluster -1) with id > after_id.
+
+    Exported ids are tracked in exported_anomalies, because anomalies are
+    not exported in id order: re-clustering can turn an older alert into an
+    anomaly. The query walks idx_dbscan_cluster in id order and anti-joins on
+    the exported ids' primary key. Rows carry the raw hash, not the raw line.
+    """
     try:
-        connection = connection_pool.get_connection()
-        with connection.cursor() as cursor:
+        with db.connection() as connection, connection.cursor() as cursor:
             select_query = """
-            SELECT id, title, tags, description, system_time, computer_name, user_id, event_id, provider_name, dbscan_cluster, raw
-            FROM sigma_alerts
-            WHERE dbscan_cluster = -1
+            SELECT s.id, s.title, s.tags, s.description, s.system_time, s.computer_name, s.user_id, s.event_id, s.provider_name, s.dbscan_cluster, s.raw_hash
+            FROM sigma_alerts AS s
+            LEFT JOIN exported_anomalies AS e ON e.alert_id = s.id
+            WHERE s.dbscan_cluster = -1 AND s.id > %s AND e.alert_id IS NULL
+            ORDER BY s.id
+            LIMIT %s
             """
-            cursor.execute(select_query)
+            cursor.execute(select_query, (after_id, limit))
             anomalies = cursor.fetchall()
         return anomalies
     except Error as e:
         logging.error(f"Error fetching anomalies: {e}")
         return []
-    finally:
-        if connection.is_connected():
-            connection.close()
+
+def mark_exported(alert_ids):
+    """Record the ids of anomalies written to the CEF log. Returns False on error."""
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.executemany("INSERT IGNORE INTO exported_anomalies (alert_id) VALUES (%s)", [(alert_id,) for alert_id in alert_ids])
+            connection.commit()
+        return True
+    except Error as e:
+        logging.error(f"Error recording exported anomalies: {e}")
+        return False
+
+def unexported(alert_ids):
+    """Return the ids among alert_ids that are not in exported_anomalies yet, or None on error."""
+    if not alert_ids:
+        return set()
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(alert_ids))
+            cursor.execute(f"SELECT alert_id FROM exported_anomalies WHERE alert_id IN ({placeholders})", list(alert_ids))
+            return set(alert_ids) - {row[0] for row in cursor.fetchall()}
+    except Error as e:
+        logging.error(f"Error reading exported anomalies: {e}")
+        return None
+
+def read_export_watermark():
+    """Return (exported_through, generation) from export_state; (0, None) when it cannot be read."""
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT exported_through, generation FROM export_state WHERE id = 1")
+            row = cursor.fetchone()
+            if row is not None:
+                return row
+    except Error as e:
+        logging.error(f"Error reading the export watermark: {e}")
+    return 0, None
+
+def advance_export_watermark(exported_through, generation):
+    """Move the watermark to exported_through unless dbscan.py created older anomalies since generation was read."""
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE export_state SET exported_through = %s WHERE id = 1 AND generation = %s AND exported_through < %s",
+                (exported_through, generation, exported_through),
+            )
+            connection.commit()
+    except Error as e:
+        logging.error(f"Error advancing the export watermark: {e}")
+
+def prune_exported():
+    """Forget exported ids of alerts that retention has already removed."""
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT MIN(id) FROM sigma_alerts")
+            oldest_id = cursor.fetchone()[0]
+            if oldest_id is not None:
+                cursor.execute("DELETE FROM exported_anomalies WHERE alert_id < %s", (oldest_id,))
+                connection.commit()
+                logging.info(f"Pruned {cursor.rowcount} exported anomaly ids below {oldest_id}.")
+    except Error as e:
+        logging.error(f"Error pruning exported anomalies: {e}")
 
 def ensure_directory_exists(directory):
     """Ensure the directory exists and has write permissions."""
@@ -55,49 +126,56 @@ def ensure_directory_exists(directory):
         os.makedirs(directory)
         os.chmod(directory, 0o777)
 
-def load_logged_anomalies():
-    """Load anomalies from the CEF log file."""
-    if not os.path.exists(cef_file_path):
-        return set()
-
-    logged_anomalies = set()
-    with open(cef_file_path, "r") as cef_file:
-        for line in cef_file:
-            if line.startswith("CEF:"):
-                logged_anomalies.add(line.strip())
-    return logged_anomalies
-
-def write_to_cef(anomalies, logged_anomalies):
-    """Write anomalies to the CEF log file."""
-    new_logs = []
-    with open(cef_file_path, "a") as cef_file:
-        for anomaly in anomalies:
-            # Format the anomaly into a CEF event
-            cef_event = (
-                f"CEF:0|Sigma|UEBA|1.0|{anomaly[7]}|{anomaly[1]}|5|"
-                f"end={anomaly[4]} rt={anomaly[4]} suser={anomaly[6]} dvc={anomaly[5]} "
-                f"msg={anomaly[3]} cs1={anomaly[8]} cs1Label=ProviderName "
-                f"cs2={anomaly[2]} cs2Label=Tags cs3={anomaly[9]} cs3Label=DBScanCluster "
-                f"cs4={anomaly[10]} cs4Label=Raw"
-            )
-            if cef_event not in logged_anomalies:
-                cef_file.write(cef_event + "\n")
-                new_logs.append(cef_event)
-                logging.info(f"Logged anomaly: {cef_event}")
+@metrics.timed("export")
+def write_to_cef(anomalies):
+    """Write anomalies to the CEF log file as one batch and hand them to the syslog forwarder."""
+    cef_events = [format_cef_event(anomaly) for anomaly in anomalies]
+    if CEF_FILE_OUTPUT:
+        cef_log.write_batch(cef_events)
+    if syslog_forwarder is not None:
+        syslog_forwarder.send(cef_events)
+    metrics.inc("cef_events_exported_total", len(cef_events))
 
 def detect_and_log_anomalies():
-    """Detect anomalies and log them."""
+    """Export the anomalies that have not been written to the CEF log yet, page by page.
+
+    Pages start at the export watermark instead of the first alert, and the
+    watermark is moved to the last exported id afterwards.
+    """
     ensure_directory_exists(log_dir)
-    logged_anomalies = load_logged_anomalies()
-    anomalies = fetch_anomalies()
-    write_to_cef(anomalies, logged_anomalies)
+    watermark, generation = read_export_watermark()
+    after_id = watermark
+    while True:
+        anomalies = fetch_anomalies(after_id)
+        if not anomalies:
+            break
+        write_to_cef(raw_store.attach_raw(anomalies, RAW_COLUMN))
+        if not mark_exported([anomaly[0] for anomaly in anomalies]):
+            break
+        after_id = anomalies[-1][0]
+        if len(anomalies) < EXPORT_BATCH_SIZE:
+            break
+    if generation is not None and after_id > watermark:
+        advance_export_watermark(after_id, generation)
+
+if __name__ == "__main__":
+    apply_migrations()
+    metrics.start()
+
+    if SYSLOG_FORWARD_HOST:
+        syslog_forwarder = SyslogForwarder(SYSLOG_FORWARD_HOST, SYSLOG_FORWARD_PORT, SYSLOG_FORWARD_PROTOCOL)
+        syslog_forwarder.start()
 
-# Run the script immediately with existing data
-detect_and_log_anomalies()
+    # Run the script immediately with existing data
+    detect_and_log_anomalies()
 
-# Schedule anomaly detection and logging every 1 minute
-schedule.every(1).minute.do(detect_and_log_anomalies)
+    # Export as soon as dbscan.py reports new labels; the 1 minute schedule is
+    # a fallback for missed events
+    listener = EventListener(ALERTS_CLUSTERED)
+    schedule.every(1).minute.do(detect_and_log_anomalies)
+    schedule.every(1).hours.do(prune_exported)
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+    while True:
+        schedule.run_pending()
+        if listener.wait(timeout=1):
+            detect_and_log_anomalies()
@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import logging
+import functools
+import resource
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import db
+from atomic_file import write_atomic
+
+logger = logging.getLogger()
+
+# Prometheus text endpoint on 127.0.0.1:METRICS_PORT; 0 turns it off. Each service needs its own port
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# The same text written to a file every METRICS_FILE_SECONDS, e.g. for node_exporter's textfile collector
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_SECONDS = int(os.getenv("METRICS_FILE_SECONDS", "15"))
+
+# Every series is prefixed with this
+METRICS_PREFIX = "anomalyhunter_"
+
+# Upper bounds in seconds of the stage duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float("inf"))
+
+# Opt-in sampling profiler: the first run of PROFILE_STAGE is sampled every
+# PROFILE_INTERVAL seconds and written as collapsed stacks to PROFILE_DIR
+PROFILE_STAGE = os.getenv("PROFILE_STAGE", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# Series keyed by (name, sorted label pairs); histograms hold [bucket counts, sum, count]
+registry = {
+    "counters": {},
+    "gauges": {},
+    "histograms": {},
+}
+registry_lock = threading.Lock()
+
+profile_state = {"done": False}
+
+def series_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    key = series_key(name, labels)
+    with registry_lock:
+        registry["counters"][key] = registry["counters"].get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    key = series_key(name, labels)
+    with registry_lock:
+        registry["gauges"][key] = value
+
+def observe(name, seconds, **labels):
+    """Record a duration in a histogram."""
+    key = series_key(name, labels)
+    with registry_lock:
+        histogram = registry["histograms"].get(key)
+        if histogram is None:
+            histogram = registry["histograms"][key] = [[0] * len(DURATION_BUCKETS), 0.0, 0]
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram[0][index] += 1
+                break
+        histogram[1] += seconds
+        histogram[2] += 1
+
+@contextmanager
+def stage(name, **labels):
+    """Time a pipeline stage into stage_seconds, and profile it when it is PROFILE_STAGE's first run."""
+    profiler = None
+    if name == PROFILE_STAGE and not profile_state["done"]:
+        profile_state["done"] = True
+        profiler = SamplingProfiler(PROFILE_INTERVAL)
+        profiler.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=name, **labels)
+        if profiler is not None:
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+            profiler.write(path)
+            logger.info(f"Wrote {profiler.samples} profile samples of stage {name} to {path}.")
+
+def timed(name, **labels):
+    """Decorator timing every call of a function as a stage."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def drain():
+    """Return and reset the registry; a worker process hands this to its parent, which merges it."""
+    with registry_lock:
+        snapshot = {kind: dict(series) for kind, series in registry.items()}
+        for series in registry.values():
+            series.clear()
+    return snapshot
+
+def merge(snapshot):
+    """Add a drained registry to this process's registry."""
+    with registry_lock:
+        for key, value in snapshot["counters"].items():
+            registry["counters"][key] = registry["counters"].get(key, 0) + value
+        registry["gauges"].update(snapshot["gauges"])
+        for key, (buckets, total, count) in snapshot["histograms"].items():
+            histogram = registry["histograms"].setdefault(key, [[0] * len(DURATION_BUCKETS), 0.0, 0])
+            histogram[0] = [mine + theirs for mine, theirs in zip(histogram[0], buckets)]
+            histogram[1] += total
+            histogram[2] += count
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+
+def process_series():
+    """Peak RSS of this process and of its waited-for children, and the connection pool stats."""
+    kilobytes = 1024  # ru_maxrss is in kilobytes on Linux
+    series = {
+        "peak_rss_bytes": ("gauge", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * kilobytes),
+        "children_peak_rss_bytes": ("gauge", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * kilobytes),
+    }
+    pool = db.pool_stats()
+    series["db_pool_size"] = ("gauge", pool["pool_size"])
+    series["db_pool_in_use"] = ("gauge", pool["in_use"])
+    series["db_pool_checkouts_total"] = ("counter", pool["checkouts"])
+    series["db_pool_wait_seconds_total"] = ("counter", pool["wait_seconds_total"])
+    series["db_pool_wait_seconds_max"] = ("gauge", pool["wait_seconds_max"])
+    series["db_pool_exhausted_waits_total"] = ("counter", pool["exhausted_waits"])
+    series["db_pool_connect_failures_total"] = ("counter", pool["connect_failures"])
+    return series
+
+def render():
+    """Render the registry and process metrics in the Prometheus text exposition format."""
+    with registry_lock:
+        counters = sorted(registry["counters"].items())
+        gauges = sorted(registry["gauges"].items())
+        histograms = sorted((key, (list(buckets), total, count)) for key, (buckets, total, count) in registry["histograms"].items())
+
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in series:
+            declare(name, kind)
+            lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {value}")
+    for (name, labels), (buckets, total, count) in histograms:
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, bucket in zip(DURATION_BUCKETS, buckets):
+            cumulative += bucket
+            le = "+Inf" if bound == float("inf") else str(bound)
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels(labels, [('le', le)])} {cumulative}")
+        lines.append(f"{METRICS_PREFIX}{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{METRICS_PREFIX}{name}_count{format_labels(labels)} {count}")
+    for name, (kind, value) in process_series().items():
+        declare(name, kind)
+        lines.append(f"{METRICS_PREFIX}{name} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would flood the service log
+
+def metrics_file_loop():
+    while True:
+        time.sleep(METRICS_FILE_SECONDS)
+        try:
+            write_atomic(METRICS_FILE, render())
+        except OSError as e:
+            logger.error(f"Error writing metrics file {METRICS_FILE}: {e}")
+
+def start():
+    """Serve the metrics and start the metrics file writer, as configured; both run in daemon threads."""
+    if METRICS_PORT:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics.")
+    if METRICS_FILE:
+        threading.Thread(target=metrics_file_loop, name="metrics-file", daemon=True).start()
+        logger.info(f"Writing metrics to {METRICS_FILE} every {METRICS_FILE_SECONDS} seconds.")
+
+class SamplingProfiler:
+    """Sample the Python stacks of every thread of this process from a background thread.
+
+    Stacks are counted in collapsed form, "thread;file:function;...
+    count" per line, which flamegraph.pl and speedscope read directly.
+    Native code that holds the GIL shows up as the Python frame that called
+    it; worker processes are not sampled.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
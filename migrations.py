@@ -0,0 +1,286 @@
+import os
+import logging
+from datetime import date, datetime, timedelta
+from mysql.connector import Error
+import db
+from raw_store import store_raw
+
+logger = logging.getLogger()
+
+# Days of alerts kept in sigma_alerts
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "7"))
+
+# Daily partitions created ahead of today, so inserts never land in the catch-all partition
+PARTITION_DAYS_AHEAD = 3
+
+# Rows per committed chunk when copying raw payloads into alert_raw
+RAW_BACKFILL_CHUNK = 10000
+
+# Named lock serialising migrations when several services start at once
+MIGRATION_LOCK = "anomalyhunter_schema_migrations"
+
+# Schema inspection helpers
+def table_exists(cursor, table_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,),
+    )
+    return cursor.fetchone() is not None
+
+def column_exists(cursor, table_name, column_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table_name, column_name),
+    )
+    return cursor.fetchone() is not None
+
+def index_exists(cursor, table_name, index_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+        (table_name, index_name),
+    )
+    return cursor.fetchone() is not None
+
+def partition_bounds(cursor, table_name):
+    """Return (partition_name, upper bound in TO_DAYS or None for MAXVALUE) for each partition, in order."""
+    cursor.execute(
+        """
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (table_name,),
+    )
+    return [(name, None if bound == "MAXVALUE" else int(bound)) for name, bound in cursor.fetchall()]
+
+def add_column(cursor, table_name, column_name, column_definition):
+    if not column_exists(cursor, table_name, column_name):
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+        logger.info(f"Added '{column_name}' column to '{table_name}' table.")
+
+def add_index(cursor, table_name, index_name, columns):
+    if not index_exists(cursor, table_name, index_name):
+        cursor.execute(f"ALTER TABLE {table_name} ADD INDEX {index_name} ({columns})")
+        logger.info(f"Added index '{index_name}' on '{table_name}' ({columns}).")
+
+def to_days(day):
+    """MySQL TO_DAYS() of a date."""
+    return day.toordinal() + 365
+
+def day_partition(day):
+    """Partition clause holding the rows of one day."""
+    return f"PARTITION p{day:%Y%m%d} VALUES LESS THAN ({to_days(day + timedelta(days=1))})"
+
+# Migrations
+def create_base_tables(cursor):
+    for table_name in ("sigma_alerts", "dbscan_outlier"):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            title VARCHAR(255),
+            tags TEXT,
+            description TEXT,
+            system_time DATETIME,
+            computer_name VARCHAR(100),
+            user_id VARCHAR(100),
+            event_id VARCHAR(50),
+            provider_name VARCHAR(100),
+            dbscan_cluster INT,
+            raw TEXT
+        )
+        """)
+        # Tables created by early versions lack these columns
+        add_column(cursor, table_name, "dbscan_cluster", "INT")
+        add_column(cursor, table_name, "raw", "TEXT")
+
+def add_ingest_batches(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_batches (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        source VARCHAR(255),
+        row_count INT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    for table_name in ("sigma_alerts", "dbscan_outlier"):
+        add_column(cursor, table_name, "ingest_batch_id", "BIGINT")
+        add_index(cursor, table_name, "idx_ingest_batch_id", "ingest_batch_id")
+
+def add_sigma_alerts_indexes(cursor):
+    add_index(cursor, "sigma_alerts", "idx_system_time", "system_time")
+    add_index(cursor, "sigma_alerts", "idx_dbscan_cluster", "dbscan_cluster")
+    add_index(cursor, "sigma_alerts", "idx_computer_user", "computer_name, user_id")
+
+def partition_sigma_alerts_by_day(cursor):
+    """Range-partition sigma_alerts on TO_DAYS(system_time) so retention can drop whole days.
+
+    MySQL requires the partitioning column in every unique key, so the primary
+    key becomes (id, system_time) and system_time becomes NOT NULL. Rows with
+    no system_time are given the day they are migrated on. On a large table
+    this rebuilds it once.
+    """
+    if partition_bounds(cursor, "sigma_alerts"):
+        return
+    logger.info("Partitioning 'sigma_alerts' by day, this rebuilds the table once.")
+    cursor.execute("UPDATE sigma_alerts SET system_time = NOW() WHERE system_time IS NULL")
+    cursor.execute("""
+    ALTER TABLE sigma_alerts
+        MODIFY system_time DATETIME NOT NULL,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (id, system_time)
+    """)
+    today = date.today()
+    days = [today + timedelta(days=offset) for offset in range(-RETENTION_DAYS, PARTITION_DAYS_AHEAD + 1)]
+    partitions = [f"PARTITION p_past VALUES LESS THAN ({to_days(days[0])})"]
+    partitions += [day_partition(day) for day in days]
+    partitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    cursor.execute(f"ALTER TABLE sigma_alerts PARTITION BY RANGE (TO_DAYS(system_time)) ({', '.join(partitions)})")
+
+def add_exported_anomalies(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS exported_anomalies (
+        alert_id INT PRIMARY KEY,
+        exported_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def move_raw_to_alert_raw(cursor):
+    """Move raw out of the alert tables into alert_raw, stored once per distinct line and compressed.
+
+    The alert tables keep a 16-byte raw_hash instead. Existing payloads are
+    copied in id order and committed per chunk, so an interrupted run resumes
+    with the rows it had not reached. Dropping the column rebuilds each table
+    once.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS alert_raw (
+        raw_hash BINARY(16) PRIMARY KEY,
+        codec TINYINT NOT NULL,
+        payload MEDIUMBLOB NOT NULL,
+        last_seen DATETIME NOT NULL,
+        INDEX idx_last_seen (last_seen)
+    )
+    """)
+    for table_name in ("sigma_alerts", "dbscan_outlier"):
+        add_column(cursor, table_name, "raw_hash", "BINARY(16)")
+        if not column_exists(cursor, table_name, "raw"):
+            continue
+        last_id = 0
+        while True:
+            cursor.execute(
+                f"""
+                SELECT id, raw, system_time FROM {table_name}
+                WHERE id > %s AND raw IS NOT NULL AND raw_hash IS NULL
+                ORDER BY id LIMIT %s
+                """,
+                (last_id, RAW_BACKFILL_CHUNK),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            hashes = store_raw(cursor, [(raw, system_time or datetime.now()) for _, raw, system_time in rows])
+            cursor.executemany(
+                f"UPDATE {table_name} SET raw_hash = %s WHERE id = %s",
+                [(raw_hash, alert_id) for (alert_id, _, _), raw_hash in zip(rows, hashes)],
+            )
+            cursor.execute("COMMIT")
+            last_id = rows[-1][0]
+            logger.info(f"Moved raw payloads of '{table_name}' up to id {last_id} to 'alert_raw'.")
+        cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN raw")
+        logger.info(f"Dropped 'raw' column from '{table_name}' table.")
+
+def add_export_state(cursor):
+    """Add the export watermark: every anomaly with id <= exported_through has been exported.
+
+    dbscan.py lowers it and bumps generation when re-clustering turns an
+    older alert into an anomaly; logger.py only advances it when generation
+    did not change during its pass.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS export_state (
+        id TINYINT PRIMARY KEY,
+        exported_through INT NOT NULL,
+        generation BIGINT NOT NULL
+    )
+    """)
+    cursor.execute("INSERT IGNORE INTO export_state (id, exported_through, generation) VALUES (1, 0, 0)")
+
+# Ordered (version, name, migration) list; versions are never reused or reordered
+MIGRATIONS = [
+    (1, "create sigma_alerts and dbscan_outlier", create_base_tables),
+    (2, "add ingest_batches and ingest_batch_id", add_ingest_batches),
+    (3, "index sigma_alerts on system_time, dbscan_cluster and computer_name/user_id", add_sigma_alerts_indexes),
+    (4, "partition sigma_alerts by day", partition_sigma_alerts_by_day),
+    (5, "add exported_anomalies", add_exported_anomalies),
+    (6, "move raw payloads to content-addressed alert_raw", move_raw_to_alert_raw),
+    (7, "add export_state watermark", add_export_state),
+]
+
+def apply_migrations():
+    """Apply the pending schema migrations in version order and record each one in schema_migrations.
+
+    Every migration checks the live schema before changing it, so re-running
+    one against a database that already has its changes is a no-op. Raises
+    when the migration lock is not acquired or a migration fails, so no
+    service starts on a schema it does not expect.
+    """
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, 300)", (MIGRATION_LOCK,))
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError(f"Could not acquire the schema migration lock '{MIGRATION_LOCK}' within 300 seconds.")
+            try:
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(255),
+                    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+                """)
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cursor.fetchall()}
+
+                for version, name, migration in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    logger.info(f"Applying schema migration {version}: {name}")
+                    migration(cursor)
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    connection.commit()
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+                cursor.fetchone()
+        logger.info("Database schema is up to date.")
+    except Error as e:
+        logger.error(f"Error applying schema migrations: {e}")
+        raise
+
+def rotate_partitions(cursor, cutoff):
+    """Drop the day partitions of sigma_alerts that end before cutoff and add the upcoming ones.
+
+    Returns False when sigma_alerts is not partitioned.
+    """
+    bounds = partition_bounds(cursor, "sigma_alerts")
+    if not bounds:
+        return False
+
+    expired = [name for name, bound in bounds if bound is not None and bound <= to_days(cutoff)]
+    if expired:
+        cursor.execute(f"ALTER TABLE sigma_alerts DROP PARTITION {', '.join(expired)}")
+        logger.info(f"Dropped partitions {', '.join(expired)} from 'sigma_alerts'.")
+
+    # Split the catch-all partition into the missing days ahead; it is empty
+    # in normal operation, so this only rewrites metadata
+    last_bound = max((bound for _, bound in bounds if bound is not None), default=to_days(date.today()))
+    first_day = date.fromordinal(last_bound - 365)
+    last_day = date.today() + timedelta(days=PARTITION_DAYS_AHEAD)
+    new_days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    if new_days:
+        partitions = [day_partition(day) for day in new_days] + ["PARTITION p_future VALUES LESS THAN MAXVALUE"]
+        cursor.execute(f"ALTER TABLE sigma_alerts REORGANIZE PARTITION p_future INTO ({', '.join(partitions)})")
+        logger.info(f"Added {len(new_days)} day partitions to 'sigma_alerts'.")
+    return True
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    apply_migrations()
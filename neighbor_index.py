@@ -0,0 +1,181 @@
+import os
+import logging
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors, sort_graph_by_row_values
+
+logger = logging.getLogger()
+
+# Neighbour index used for DBSCAN region queries: "exact", "lsh" or "grid"
+NEIGHBOR_INDEX = os.getenv("DBSCAN_NEIGHBOR_INDEX", "exact").lower()
+
+# Exact index: "auto", "kd_tree", "ball_tree" or "brute"
+EXACT_ALGORITHM = os.getenv("DBSCAN_EXACT_ALGORITHM", "auto")
+
+# LSH recall/speed knobs: more tables and a wider window find more neighbours and cost more
+LSH_TABLES = int(os.getenv("DBSCAN_LSH_TABLES", "4"))
+LSH_WINDOW = int(os.getenv("DBSCAN_LSH_WINDOW", "16"))
+LSH_HASHES_PER_TABLE = 4
+LSH_BUCKET_WIDTH = 4.0  # In multiples of the query radius
+
+# Grid index: number of leading dimensions the grid is laid over
+GRID_DIMS = int(os.getenv("DBSCAN_GRID_DIMS", "4"))
+
+# Candidate pairs whose distances are computed at once
+CANDIDATE_CHUNK = 1 << 18
+
+def pair_distances(data, rows, cols):
+    """Euclidean distances of the candidate pairs (rows[k], cols[k]), computed in chunks."""
+    distances = np.empty(len(rows))
+    for start in range(0, len(rows), CANDIDATE_CHUNK):
+        stop = start + CANDIDATE_CHUNK
+        diff = data[rows[start:stop]] - data[cols[start:stop]]
+        distances[start:stop] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return distances
+
+def build_graph(n_samples, rows, cols, distances):
+    """Sparse distance graph from symmetric neighbour pairs, with each point as its own zero-distance neighbour.
+
+    DBSCAN counts a point towards its own min_samples, so the diagonal is
+    stored as explicit zeros. Rows are sorted by distance as DBSCAN expects.
+    """
+    self_loops = np.arange(n_samples)
+    graph = sparse.csr_matrix(
+        (np.concatenate((distances, distances, np.zeros(n_samples))),
+         (np.concatenate((rows, cols, self_loops)), np.concatenate((cols, rows, self_loops)))),
+        shape=(n_samples, n_samples),
+    )
+    return sort_graph_by_row_values(graph, copy=False, warn_when_not_sorted=False)
+
+class ExactIndex:
+    """Exact region queries with a KD tree, ball tree or brute force."""
+
+    def __init__(self, algorithm=EXACT_ALGORITHM):
+        self.algorithm = algorithm
+
+    def radius_graph(self, data, radius):
+        # Passing the data explicitly keeps each point as its own zero-distance neighbour
+        return NearestNeighbors(radius=radius, algorithm=self.algorithm).fit(data).radius_neighbors_graph(
+            data, mode="distance", sort_results=True
+        )
+
+class LSHIndex:
+    """Approximate region queries with p-stable locality-sensitive hashing.
+
+    Each table hashes points with LSH_HASHES_PER_TABLE random projections
+    quantised to buckets LSH_BUCKET_WIDTH times the radius wide. Points are
+    sorted by bucket and compared with the next `window` points of the same
+    bucket only, so a dense bucket costs window comparisons per point instead
+    of one per member. Candidates are verified with their exact distance, so
+    the graph can miss neighbours but never holds a false one. Raising
+    `tables` or `window` trades speed for recall; keep `window` at or above
+    the largest min_samples so dense regions still yield core points.
+    """
+
+    def __init__(self, tables=LSH_TABLES, window=LSH_WINDOW, hashes_per_table=LSH_HASHES_PER_TABLE, seed=0):
+        self.tables = tables
+        self.window = window
+        self.hashes_per_table = hashes_per_table
+        self.seed = seed
+
+    def radius_graph(self, data, radius):
+        n_samples, n_features = data.shape
+        rng = np.random.default_rng(self.seed)
+        width = LSH_BUCKET_WIDTH * radius
+        candidates = []
+        for _ in range(self.tables):
+            projections = rng.standard_normal((n_features, self.hashes_per_table))
+            offsets = rng.uniform(0, width, self.hashes_per_table)
+            buckets = np.floor((data @ projections + offsets) / width).astype(np.int64)
+            # Fold the bucket coordinates into one key; collisions only add candidates
+            keys = buckets @ rng.integers(1, 1 << 31, self.hashes_per_table, dtype=np.int64)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            for distance in range(1, min(self.window, n_samples - 1) + 1):
+                same = sorted_keys[:-distance] == sorted_keys[distance:]
+                left, right = order[:-distance][same], order[distance:][same]
+                candidates.append(np.minimum(left, right) * n_samples + np.maximum(left, right))
+
+        pairs = np.unique(np.concatenate(candidates)) if candidates else np.empty(0, dtype=np.int64)
+        rows, cols = pairs // n_samples, pairs % n_samples
+        distances = pair_distances(data, rows, cols)
+        within = distances <= radius
+        logger.info(f"LSH index verified {len(pairs)} candidate pairs, kept {int(np.sum(within))}.")
+        return build_graph(n_samples, rows[within], cols[within], distances[within])
+
+class GridIndex:
+    """Exact region queries through a uniform grid over the leading `dims` dimensions.
+
+    Cells are one radius wide, so every neighbour lies in the same or an
+    adjacent cell of the projection: a distance in fewer dimensions is never
+    larger. Only pairs of adjacent cells are compared in full dimension. Works
+    best when the leading dimensions spread the data; dense cells still cost
+    one comparison per pair.
+    """
+
+    def __init__(self, dims=GRID_DIMS):
+        self.dims = dims
+
+    def radius_graph(self, data, radius):
+        n_samples = data.shape[0]
+        dims = min(self.dims, data.shape[1])
+        cells = np.floor(data[:, :dims] / radius).astype(np.int64)
+        cells -= cells.min(axis=0) - 1
+        radix = cells.max(axis=0) + 2
+        # Drop trailing dimensions until the cell keys fit in an int64
+        while dims > 1 and np.prod(radix[:dims].astype(float)) >= 2 ** 62:
+            dims -= 1
+        strides = np.concatenate(([1], np.cumprod(radix[:dims - 1])))
+        keys = cells[:, :dims] @ strides
+
+        order = np.argsort(keys, kind="stable")
+        cell_keys, cell_starts, cell_sizes = np.unique(keys[order], return_index=True, return_counts=True)
+
+        rows, cols, distances = [], [], []
+        for offset in np.array(np.meshgrid(*[[-1, 0, 1]] * dims)).reshape(dims, -1).T:
+            # Visit each unordered pair of cells once: the zero offset and every other offset with its first non-zero step positive
+            nonzero = offset[offset != 0]
+            if len(nonzero) and nonzero[0] < 0:
+                continue
+            target_keys = cell_keys + offset @ strides
+            neighbors = np.minimum(np.searchsorted(cell_keys, target_keys), len(cell_keys) - 1)
+            matched = cell_keys[neighbors] == target_keys
+            source, target = np.nonzero(matched)[0], neighbors[matched]
+            for left, right in cross_pairs(cell_starts[source], cell_sizes[source], cell_starts[target], cell_sizes[target]):
+                left, right = order[left], order[right]
+                if not len(nonzero):
+                    keep = left < right  # Within one cell, each pair once and no self pairs
+                    left, right = left[keep], right[keep]
+                pair_distance = pair_distances(data, left, right)
+                within = pair_distance <= radius
+                rows.append(left[within])
+                cols.append(right[within])
+                distances.append(pair_distance[within])
+
+        if not rows:
+            return build_graph(n_samples, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        return build_graph(n_samples, np.concatenate(rows), np.concatenate(cols), np.concatenate(distances))
+
+def cross_pairs(starts_a, sizes_a, starts_b, sizes_b):
+    """Yield (left, right) sorted-order positions of every point pair between matched cells, in bounded chunks."""
+    pair_counts = sizes_a * sizes_b
+    cumulative = np.cumsum(pair_counts)
+    start = 0
+    while start < len(pair_counts):
+        done = cumulative[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(cumulative, done + CANDIDATE_CHUNK, side="right")))
+        counts = pair_counts[start:stop]
+        owner = np.repeat(np.arange(start, stop), counts)
+        local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        yield starts_a[owner] + local // sizes_b[owner], starts_b[owner] + local % sizes_b[owner]
+        start = stop
+
+def make_neighbor_index(name=NEIGHBOR_INDEX):
+    """Return the neighbour index selected by name."""
+    if name == "exact":
+        return ExactIndex()
+    if name == "lsh":
+        return LSHIndex()
+    if name == "grid":
+        return GridIndex()
+    raise ValueError(f"Unknown neighbour index '{name}', expected exact, lsh or grid.")
@@ -0,0 +1,199 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import SQL as ingest
+import dbscan as clustering
+import logger as export
+import metrics
+from syslog_forwarder import SyslogForwarder, SYSLOG_FORWARD_HOST, SYSLOG_FORWARD_PORT, SYSLOG_FORWARD_PROTOCOL
+from migrations import apply_migrations
+
+logger = logging.getLogger()
+
+# Ingested chunks held between ingest and clustering, and cluster results held before export
+PIPELINE_QUEUE_BATCHES = int(os.getenv("PIPELINE_QUEUE_BATCHES", "32"))
+
+# Queued chunks are merged into one clustering run up to this many rows
+PIPELINE_CLUSTER_MAX_ROWS = int(os.getenv("PIPELINE_CLUSTER_MAX_ROWS", "20000"))
+
+# Fallback runs against the database, matching the schedules of the separate services
+CLUSTER_FALLBACK_SECONDS = 5 * 60
+EXPORT_FALLBACK_SECONDS = 60
+PRUNE_EXPORTED_SECONDS = 60 * 60
+TRUNCATE_SECONDS = 12 * 60 * 60
+
+# Export queue item asking for a scan of sigma_alerts for unexported anomalies
+SCAN_TABLE = None
+
+def cluster_rows(ids, rows):
+    """Cluster ingested rows in the clustering worker process.
+
+    Between full re-fits the rows are assigned in memory. Returns the
+    anomalies among them, as rows in the shape logger.py exports, or
+    SCAN_TABLE when a full re-fit ran and may have relabelled any alert.
+    """
+    if clustering.full_refit_due():
+        clustering.cluster_all_alerts()
+        return SCAN_TABLE
+    data = [(alert_id, row[0], row[1], row[4], row[5], row[6], row[7]) for alert_id, row in zip(ids, rows)]
+    labels = clustering.assign_new_alerts(data)
+    return [
+        (alert_id, row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], -1, row[8])
+        for alert_id, row, label in zip(ids, rows, labels)
+        if label == -1
+    ]
+
+def cluster_table():
+    """Fallback clustering run against the database in the clustering worker process."""
+    clustering.detect_anomalies()
+    return SCAN_TABLE
+
+def with_metrics(function, *args):
+    """Run a clustering job in the worker process and return its result with the metrics it recorded."""
+    return function(*args), metrics.drain()
+
+class Pipeline:
+    """Run ingest, clustering and export as stages of one process.
+
+    The folder monitor of SQL.py runs in a thread and hands each committed
+    chunk, with its ids, to a bounded queue; a full queue blocks ingest. The
+    clustering stage merges queued chunks and runs them in a single worker
+    process, which keeps the fitted feature space and core points between
+    runs. Anomalies go through a second bounded queue to the export stage,
+    which writes them without reading them back from MySQL. MySQL stays the
+    system of record: every chunk is committed before it is queued, and the
+    fallback runs pick up whatever the queues did not carry.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.cluster_queue = None
+        self.export_queue = None
+        self.cluster_executor = self.start_cluster_worker()
+
+    @staticmethod
+    def start_cluster_worker():
+        # forkserver: the worker must not inherit the ingest threads' locks
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=clustering.restore_clustering_state,
+        )
+
+    async def run_clustering(self, function, *args):
+        """Run a clustering job in the worker process and merge its metrics into this process.
+
+        A worker that died, e.g. OOM-killed, breaks the pool; it is replaced
+        so the next job runs in a fresh worker restored from the artifacts,
+        and the failed job is left to the fallback runs.
+        """
+        try:
+            result, worker_metrics = await self.loop.run_in_executor(self.cluster_executor, with_metrics, function, *args)
+        except BrokenProcessPool:
+            logger.error("Clustering worker died, starting a new one.")
+            self.cluster_executor.shutdown(wait=False)
+            self.cluster_executor = self.start_cluster_worker()
+            raise
+        metrics.merge(worker_metrics)
+        return result
+
+    def on_ingested(self, ids, rows):
+        """Ingest listener, called from the ingest threads; blocks while the cluster queue is full."""
+        if ids:
+            asyncio.run_coroutine_threadsafe(self.cluster_queue.put((ids, rows)), self.loop).result()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.cluster_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_BATCHES)
+        self.export_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_BATCHES)
+
+        await asyncio.to_thread(ingest.truncate_old_data)
+        await self.export_queue.put(await self.run_clustering(cluster_table))
+
+        ingest.ingest_listeners.append(self.on_ingested)
+        monitor = threading.Thread(target=ingest.monitor_folder, args=(ingest.log_folder,), name="ingest", daemon=True)
+        monitor.start()
+
+        await asyncio.gather(
+            self.cluster_stage(),
+            self.export_stage(),
+            self.every(CLUSTER_FALLBACK_SECONDS, self.cluster_fallback),
+            self.every(EXPORT_FALLBACK_SECONDS, self.export_fallback),
+            self.every(PRUNE_EXPORTED_SECONDS, lambda: asyncio.to_thread(export.prune_exported)),
+            self.every(TRUNCATE_SECONDS, lambda: asyncio.to_thread(ingest.truncate_old_data)),
+        )
+
+    async def every(self, seconds, job):
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Error in scheduled pipeline job: {e}")
+
+    async def cluster_stage(self):
+        while True:
+            ids, rows = await self.cluster_queue.get()
+            # Merge whatever else is queued into the same run
+            while len(ids) < PIPELINE_CLUSTER_MAX_ROWS and not self.cluster_queue.empty():
+                more_ids, more_rows = self.cluster_queue.get_nowait()
+                ids, rows = ids + more_ids, rows + more_rows
+            try:
+                result = await self.run_clustering(cluster_rows, ids, rows)
+            except Exception as e:
+                logger.error(f"Error clustering {len(ids)} ingested alerts: {e}")
+                continue
+            await self.export_queue.put(result)
+
+    async def cluster_fallback(self):
+        await self.export_queue.put(await self.run_clustering(cluster_table))
+
+    async def export_fallback(self):
+        await self.export_queue.put(SCAN_TABLE)
+
+    async def export_stage(self):
+        # The only consumer: table scans and in-memory exports never run at
+        # the same time, and export_anomalies skips what a scan already exported
+        while True:
+            anomalies = await self.export_queue.get()
+            try:
+                if anomalies is SCAN_TABLE:
+                    await asyncio.to_thread(export.detect_and_log_anomalies)
+                elif anomalies:
+                    await asyncio.to_thread(self.export_anomalies, anomalies)
+            except Exception as e:
+                logger.error(f"Error exporting anomalies: {e}")
+
+    @staticmethod
+    def export_anomalies(anomalies):
+        """Export in-memory anomalies that no table scan has exported yet.
+
+        Labels are stored before the anomalies are queued, so a scan queued
+        in between can already have exported some of them.
+        """
+        pending = export.unexported([anomaly[0] for anomaly in anomalies])
+        if pending is None:
+            return  # Left to the next table scan
+        anomalies = [anomaly for anomaly in anomalies if anomaly[0] in pending]
+        if not anomalies:
+            return
+        export.ensure_directory_exists(export.log_dir)
+        export.write_to_cef(anomalies)
+        export.mark_exported([anomaly[0] for anomaly in anomalies])
+
+if __name__ == "__main__":
+    apply_migrations()
+    metrics.start()
+
+    if SYSLOG_FORWARD_HOST:
+        export.syslog_forwarder = SyslogForwarder(SYSLOG_FORWARD_HOST, SYSLOG_FORWARD_PORT, SYSLOG_FORWARD_PROTOCOL)
+        export.syslog_forwarder.start()
+
+    try:
+        asyncio.run(Pipeline().run())
+    except KeyboardInterrupt:
+        logger.info("Stopping pipeline.")
@@ -0,0 +1,133 @@
+import os
+import zlib
+import hashlib
+import logging
+import threading
+from mysql.connector import Error
+import db
+import metrics
+
+logger = logging.getLogger()
+
+# zstd compresses the JSON lines better and faster when zstandard is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec of newly stored payloads: "zstd" or "zlib"; zstd falls back to zlib when zstandard is missing
+RAW_CODEC = os.getenv("RAW_CODEC", "zstd").lower()
+# Level 3, zstd's default, compresses alert lines as tightly as 6 at two thirds of the cost
+RAW_COMPRESSION_LEVEL = int(os.getenv("RAW_COMPRESSION_LEVEL", "3" if RAW_CODEC == "zstd" else "6"))
+
+# Codec ids stored with each payload, so payloads written with either codec stay readable
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# Bytes of the BLAKE2b digest keying alert_raw
+RAW_HASH_BYTES = 16
+
+# Hashes per SELECT ... IN lookup and rows per retention DELETE
+LOOKUP_CHUNK = 1000
+PRUNE_CHUNK = 10000
+
+# zstd contexts per thread, reused for every line; one context must not be used by two threads at once
+zstd_contexts = threading.local()
+
+def zstd_compressor():
+    if not hasattr(zstd_contexts, "compressor"):
+        zstd_contexts.compressor = zstandard.ZstdCompressor(level=RAW_COMPRESSION_LEVEL)
+    return zstd_contexts.compressor
+
+def zstd_decompressor():
+    if not hasattr(zstd_contexts, "decompressor"):
+        zstd_contexts.decompressor = zstandard.ZstdDecompressor()
+    return zstd_contexts.decompressor
+
+def raw_hash(raw):
+    """Content address of a raw line."""
+    return hashlib.blake2b(raw.encode("utf-8", errors="replace"), digest_size=RAW_HASH_BYTES).digest()
+
+def compress(raw):
+    """Return (codec id, compressed bytes) of a raw line."""
+    data = raw.encode("utf-8", errors="replace")
+    if RAW_CODEC == "zstd" and zstandard is not None:
+        return CODEC_ZSTD, zstd_compressor().compress(data)
+    return CODEC_ZLIB, zlib.compress(data, RAW_COMPRESSION_LEVEL)
+
+def decompress(codec, payload):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("payload is zstd-compressed but zstandard is not installed")
+        return zstd_decompressor().decompress(payload).decode("utf-8", errors="replace")
+    return zlib.decompress(payload).decode("utf-8", errors="replace")
+
+def store_raw(cursor, rows):
+    """Store the raw lines of (raw, system_time) pairs once per distinct content and return their hashes in order.
+
+    A payload that is already stored only has its last_seen moved forward,
+    so it outlives the newest alert referencing it and no longer.
+    """
+    hashes = []
+    distinct = {}
+    for raw, system_time in rows:
+        if raw is None:
+            hashes.append(None)
+            continue
+        digest = raw_hash(raw)
+        hashes.append(digest)
+        if digest not in distinct:
+            distinct[digest] = [raw, system_time]
+        elif system_time > distinct[digest][1]:
+            distinct[digest][1] = system_time
+    if distinct:
+        cursor.executemany(
+            """
+            INSERT INTO alert_raw (raw_hash, codec, payload, last_seen) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE last_seen = GREATEST(last_seen, VALUES(last_seen))
+            """,
+            # Hash order, so concurrent ingest threads lock shared payloads in the same order
+            [(digest, *compress(raw), system_time) for digest, (raw, system_time) in sorted(distinct.items())],
+        )
+    return hashes
+
+@metrics.timed("fetch_raw")
+def fetch_raw(hashes):
+    """Return {hash: raw line} for the given hashes; missing or unreadable payloads are left out."""
+    wanted = list({digest for digest in hashes if digest is not None})
+    found = {}
+    if not wanted:
+        return found
+    try:
+        with db.connection() as connection, connection.cursor() as cursor:
+            for i in range(0, len(wanted), LOOKUP_CHUNK):
+                chunk = wanted[i:i + LOOKUP_CHUNK]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"SELECT raw_hash, codec, payload FROM alert_raw WHERE raw_hash IN ({placeholders})", chunk)
+                for digest, codec, payload in cursor.fetchall():
+                    try:
+                        found[bytes(digest)] = decompress(codec, payload)
+                    except (ValueError, zlib.error) as e:
+                        logger.error(f"Error decompressing raw payload {bytes(digest).hex()}: {e}")
+    except Error as e:
+        logger.error(f"Error fetching raw payloads: {e}")
+    return found
+
+def attach_raw(rows, column):
+    """Replace the raw hash in the given column of each row with its raw line, fetched in one pass."""
+    found = fetch_raw([bytes(row[column]) for row in rows if row[column] is not None])
+    return [
+        (*row[:column], found.get(bytes(row[column])) if row[column] is not None else None, *row[column + 1:])
+        for row in rows
+    ]
+
+def prune_raw(connection, cursor, cutoff):
+    """Delete payloads last seen before cutoff, committing every PRUNE_CHUNK rows; returns the number deleted."""
+    deleted = 0
+    while True:
+        cursor.execute("DELETE FROM alert_raw WHERE last_seen < %s LIMIT %s", (cutoff, PRUNE_CHUNK))
+        chunk = cursor.rowcount
+        connection.commit()
+        deleted += chunk
+        if chunk < PRUNE_CHUNK:
+            return deleted
@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+from collections import Counter
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+logger = logging.getLogger()
+
+# Micro-cluster radius in the scaled feature space, and the most micro-clusters kept
+STREAM_RADIUS = float(os.getenv("DBSCAN_STREAM_RADIUS", "0.5"))
+STREAM_MAX_MICRO_CLUSTERS = int(os.getenv("DBSCAN_STREAM_MAX_MICRO_CLUSTERS", "5000"))
+
+# Micro-cluster weights halve over this period
+STREAM_HALF_LIFE_SECONDS = float(os.getenv("DBSCAN_STREAM_HALF_LIFE_SECONDS", str(24 * 3600)))
+
+# Decayed weight that makes a micro-cluster dense; lighter ones are outliers
+STREAM_MIN_WEIGHT = float(os.getenv("DBSCAN_STREAM_MIN_WEIGHT", "5"))
+
+# Dense micro-clusters whose centres are within this distance form one cluster
+STREAM_MACRO_EPS = float(os.getenv("DBSCAN_STREAM_MACRO_EPS", str(2 * STREAM_RADIUS)))
+
+class MicroClusterModel:
+    """Streaming density clustering over decaying micro-clusters, in the style of DenStream and DBSTREAM.
+
+    Each micro-cluster keeps a centre, a weight that halves every
+    half_life_seconds and a stable id. A point is absorbed by the nearest
+    micro-cluster within radius, which moves the centre to the weighted mean
+    and adds one to the weight, or it opens a new micro-cluster. When the
+    model is full, the lightest micro-cluster is evicted, so memory is bounded
+    by max_micro_clusters whatever the stream length, and absorbing a point
+    costs one distance computation per micro-cluster.
+
+    recluster() runs DBSCAN over the dense micro-cluster centres, weighted by
+    their weights, and maps every micro-cluster to a cluster label. Labels are
+    carried over from the previous reclustering by majority of member
+    micro-clusters, so cluster ids stay stable. A micro-cluster that becomes
+    dense between reclusterings gets a provisional label right away: the
+    label of the nearest labelled dense micro-cluster within macro_eps, as
+    recluster() would link them, or a new one. A point absorbed by a dense
+    micro-cluster gets its label; any other point is an outlier (-1).
+    """
+
+    def __init__(self, n_features, radius=STREAM_RADIUS, max_micro_clusters=STREAM_MAX_MICRO_CLUSTERS,
+                 half_life_seconds=STREAM_HALF_LIFE_SECONDS, min_weight=STREAM_MIN_WEIGHT, macro_eps=STREAM_MACRO_EPS):
+        self.radius = radius
+        self.max_micro_clusters = max_micro_clusters
+        self.decay_rate = np.log(2) / half_life_seconds
+        self.min_weight = min_weight
+        self.macro_eps = macro_eps
+        self.centres = np.empty((max_micro_clusters, n_features))
+        self.weights = np.zeros(max_micro_clusters)
+        self.updated = np.zeros(max_micro_clusters)
+        self.ids = np.full(max_micro_clusters, -1, dtype=np.int64)
+        self.labels = np.full(max_micro_clusters, -1, dtype=np.int64)
+        self.count = 0
+        self.next_id = 0
+        self.next_label = 0
+        self.previous_labels = {}
+
+    def decayed_weights(self, now):
+        count = self.count
+        return self.weights[:count] * np.exp(-self.decay_rate * (now - self.updated[:count]))
+
+    def absorb(self, point, now=None):
+        """Absorb one point and return its cluster label, or -1 when it is an outlier."""
+        now = time.time() if now is None else now
+        count = self.count
+        if count:
+            diff = self.centres[:count] - point
+            distances = np.einsum("ij,ij->i", diff, diff)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.radius ** 2:
+                weight = self.weights[nearest] * np.exp(-self.decay_rate * (now - self.updated[nearest])) + 1
+                self.centres[nearest] += (point - self.centres[nearest]) / weight
+                self.weights[nearest] = weight
+                self.updated[nearest] = now
+                if weight < self.min_weight:
+                    return -1
+                if self.labels[nearest] < 0:
+                    return self.provisional_label(nearest, now)
+                return int(self.labels[nearest])
+
+        slot = count
+        if count == self.max_micro_clusters:
+            slot = int(np.argmin(self.decayed_weights(now)))  # Evict the lightest micro-cluster
+        else:
+            self.count += 1
+        self.centres[slot] = point
+        self.weights[slot] = 1.0
+        self.updated[slot] = now
+        self.ids[slot] = self.next_id
+        self.labels[slot] = -1
+        self.next_id += 1
+        return -1
+
+    def provisional_label(self, slot, now):
+        """Label a micro-cluster that became dense since the last recluster() and return the label."""
+        count = self.count
+        linked = (self.decayed_weights(now) >= self.min_weight) & (self.labels[:count] >= 0)
+        diff = self.centres[:count] - self.centres[slot]
+        distances = np.where(linked, np.einsum("ij,ij->i", diff, diff), np.inf)
+        nearest = int(np.argmin(distances))
+        if distances[nearest] <= self.macro_eps ** 2:
+            label = int(self.labels[nearest])
+        else:
+            label = self.next_label
+            self.next_label += 1
+        self.labels[slot] = label
+        # recluster() carries it over like any other label
+        self.previous_labels[int(self.ids[slot])] = label
+        return label
+
+    def absorb_all(self, points, now=None):
+        """Absorb points in order and return their labels."""
+        return np.array([self.absorb(point, now) for point in points], dtype=int)
+
+    def predict(self, points, now=None):
+        """Label points by their nearest micro-cluster without absorbing them."""
+        now = time.time() if now is None else now
+        labels = np.full(len(points), -1, dtype=int)
+        if not self.count:
+            return labels
+        dense_labels = np.where(self.decayed_weights(now) >= self.min_weight, self.labels[:self.count], -1)
+        for index, point in enumerate(points):
+            diff = self.centres[:self.count] - point
+            distances = np.einsum("ij,ij->i", diff, diff)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.radius ** 2:
+                labels[index] = dense_labels[nearest]
+        return labels
+
+    def recluster(self, now=None):
+        """Label the micro-clusters by running weighted DBSCAN over the dense centres."""
+        now = time.time() if now is None else now
+        weights = self.decayed_weights(now)
+        dense = np.nonzero(weights >= self.min_weight)[0]
+        self.labels[:self.count] = -1
+        if not len(dense):
+            return
+
+        # A dense micro-cluster is a core point on its own; nearby ones join its cluster
+        macro_labels = DBSCAN(eps=self.macro_eps, min_samples=int(np.ceil(self.min_weight))).fit(
+            self.centres[dense], sample_weight=weights[dense]
+        ).labels_
+
+        previous = self.previous_labels
+        taken = set()
+        for macro_label in np.unique(macro_labels[macro_labels >= 0]):
+            members = dense[macro_labels == macro_label]
+            votes = Counter(previous.get(int(micro_id), -1) for micro_id in self.ids[members])
+            votes.pop(-1, None)
+            label = next((label for label, _ in votes.most_common() if label not in taken), None)
+            if label is None:
+                label = self.next_label
+                self.next_label += 1
+            taken.add(label)
+            self.labels[members] = label
+        self.previous_labels = {int(micro_id): int(label) for micro_id, label in zip(self.ids[:self.count], self.labels[:self.count])}
+        logger.info(f"Reclustered {len(dense)} dense of {self.count} micro-clusters into {len(taken)} clusters.")
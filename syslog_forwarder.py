@@ -0,0 +1,207 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+# Collector endpoint; forwarding is disabled while SYSLOG_FORWARD_HOST is unset
+SYSLOG_FORWARD_HOST = os.getenv("SYSLOG_FORWARD_HOST")
+SYSLOG_FORWARD_PORT = int(os.getenv("SYSLOG_FORWARD_PORT", "514"))
+SYSLOG_FORWARD_PROTOCOL = os.getenv("SYSLOG_FORWARD_PROTOCOL", "tcp").lower()
+
+# Bounded in-memory queue, batching and spill file used while the collector is down
+QUEUE_SIZE = int(os.getenv("SYSLOG_FORWARD_QUEUE_SIZE", "10000"))
+BATCH_SIZE = 500
+ENQUEUE_TIMEOUT = 5
+SPILL_PATH = os.getenv("SYSLOG_FORWARD_SPILL_PATH", "/var/lib/anomalyhunter/syslog_spill.log")
+
+# Reconnect backoff
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+CONNECT_TIMEOUT = 5
+
+# local6.info, matching the rsyslog imfile input
+FACILITY = 22
+SEVERITY = 6
+
+def format_rfc5424(message, hostname=socket.gethostname(), app_name="anomalyhunter"):
+    """Wrap a message in an RFC 5424 syslog header."""
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return f"<{FACILITY * 8 + SEVERITY}>1 {timestamp} {hostname} {app_name} {os.getpid()} - - {message}"
+
+class SyslogForwarder:
+    """Send messages to a TCP or UDP syslog collector from a background asyncio loop.
+
+    send() puts messages on a bounded queue and blocks for up to
+    ENQUEUE_TIMEOUT seconds when the queue is full, which pushes back on the
+    exporter. If the queue is still full, the messages are written to the
+    spill file. The loop keeps one connection open, sends queued messages in
+    batches and reconnects with exponential backoff. While the collector is
+    down, batches go to the spill file, and the file is replayed first once
+    the connection is back. TCP messages use RFC 6587 octet-counting framing.
+    """
+
+    def __init__(self, host, port, protocol="tcp", queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, spill_path=SPILL_PATH):
+        if protocol not in ("tcp", "udp"):
+            raise ValueError(f"Unknown syslog protocol '{protocol}', expected tcp or udp.")
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.spill_path = spill_path
+        self.loop = None
+        self.queue = None
+        self.thread = None
+        self.stopping = False
+        self.writer = None
+        self.transport = None
+        self.backoff = BACKOFF_INITIAL
+        self.next_attempt = 0.0
+        self.spill_lock = threading.Lock()
+        self.sent = 0
+        self.spilled = 0
+
+    def start(self):
+        """Start the forwarding loop in a daemon thread."""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run_loop, args=(ready,), name="syslog-forwarder", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run_loop(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        ready.set()
+        self.loop.run_until_complete(self.forward())
+        self.loop.close()
+
+    def send(self, messages):
+        """Queue messages for forwarding, spilling them to disk if the queue stays full."""
+        leftover = asyncio.run_coroutine_threadsafe(self.enqueue(list(messages)), self.loop).result()
+        if leftover:
+            self.spill(leftover)
+
+    async def enqueue(self, messages):
+        """Put messages on the queue, waiting up to ENQUEUE_TIMEOUT for space. Returns the messages that did not fit."""
+        deadline = self.loop.time() + ENQUEUE_TIMEOUT
+        for index, message in enumerate(messages):
+            if not self.queue.full():
+                self.queue.put_nowait(message)
+                continue
+            try:
+                await asyncio.wait_for(self.queue.put(message), max(0, deadline - self.loop.time()))
+            except asyncio.TimeoutError:
+                return messages[index:]
+        return []
+
+    def stop(self, timeout=10):
+        """Flush the queue and stop the forwarding loop."""
+        self.stopping = True
+        if self.thread:
+            self.thread.join(timeout)
+
+    async def forward(self):
+        while not (self.stopping and self.queue.empty()):
+            batch = await self.next_batch()
+            if not batch:
+                continue
+            if not await self.connect():
+                self.spill(batch)
+                continue
+            try:
+                await self.replay_spill()
+                await self.write(batch)
+                self.sent += len(batch)
+            except OSError as e:
+                logger.error(f"Lost connection to syslog collector {self.host}:{self.port}: {e}")
+                self.disconnect()
+                self.spill(batch)
+        self.disconnect()
+        logger.info(f"Syslog forwarder stopped after sending {self.sent} and spilling {self.spilled} messages.")
+
+    async def next_batch(self):
+        """Wait up to a second for a message, then take whatever else is queued up to batch_size."""
+        try:
+            batch = [await asyncio.wait_for(self.queue.get(), timeout=1)]
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def connect(self):
+        """Make sure a connection is open, honouring the reconnect backoff. Returns False while down."""
+        if self.writer is not None or self.transport is not None:
+            return True
+        if time.monotonic() < self.next_attempt:
+            return False
+        try:
+            if self.protocol == "tcp":
+                _, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+            else:
+                self.transport, _ = await self.loop.create_datagram_endpoint(
+                    asyncio.DatagramProtocol, remote_addr=(self.host, self.port)
+                )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Cannot connect to syslog collector {self.host}:{self.port}, retrying in {self.backoff:.1f} s: {e}")
+            self.next_attempt = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+            return False
+        logger.info(f"Connected to syslog collector {self.host}:{self.port} over {self.protocol}.")
+        self.backoff = BACKOFF_INITIAL
+        return True
+
+    def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def write(self, messages):
+        frames = [format_rfc5424(message).encode("utf-8", errors="replace") for message in messages]
+        if self.protocol == "tcp":
+            self.writer.write(b"".join(str(len(frame)).encode() + b" " + frame for frame in frames))
+            await self.writer.drain()
+        else:
+            for frame in frames:
+                self.transport.sendto(frame)
+
+    def spill(self, messages):
+        """Append messages to the spill file for replay once the collector is reachable."""
+        with self.spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                spill_file.write("".join(message.replace("\n", " ") + "\n" for message in messages))
+            self.spilled += len(messages)
+
+    async def replay_spill(self):
+        """Send the spilled messages in batches and remove the spill file.
+
+        A replay cut short by another outage is resumed from the start, so its
+        messages may be delivered twice but never lost.
+        """
+        replay_path = f"{self.spill_path}.replay"
+        with self.spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        with open(replay_path, "r", encoding="utf-8") as replay_file:
+            batch = []
+            for line in replay_file:
+                batch.append(line.rstrip("\n"))
+                if len(batch) >= self.batch_size:
+                    await self.write(batch)
+                    batch = []
+            if batch:
+                await self.write(batch)
+        os.remove(replay_path)
+        logger.info(f"Replayed spilled messages to syslog collector {self.host}:{self.port}.")